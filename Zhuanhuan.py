@@ -1,19 +1,68 @@
+import hashlib
+import io
+import json
 import os
-from PIL import Image
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import numpy as np
+from PIL import Image, ImageSequence
+from name_index import index_for
+from emoji_pack import DEFAULT_PACK_FILE, write_pack
+from core.rawframe import pack_frame
 
 
-def preprocess_for_16x16(path_in, path_out=None, palette_colors=8, background_color=(0,0,0)):
+# Display resolutions of the fleet, every processed image is produced in all of them
+TARGET_SIZES = (16, 32, 64)
 
-    img = Image.open(path_in).convert("RGBA")
+
+def output_dir_for(output_dir, size):
+    # 16x16 stays in output_dir itself, other sizes go to sibling directories like output_32
+    return output_dir if size == 16 else f"{output_dir}_{size}"
+
+
+# Fixed palette tuned for the LED display: saturated primaries and the yellows, skin tones and browns of emojis
+DISPLAY_PALETTE = (
+    (0, 0, 0), (255, 255, 255), (64, 64, 64), (128, 128, 128), (192, 192, 192),
+    (255, 0, 0), (128, 0, 0), (255, 128, 128),
+    (0, 255, 0), (0, 128, 0),
+    (0, 0, 255), (0, 0, 128), (0, 255, 255), (0, 128, 128), (173, 216, 230),
+    (255, 255, 0), (255, 204, 77), (255, 165, 0),
+    (255, 105, 180), (128, 0, 128),
+    (255, 224, 189), (210, 140, 90), (139, 69, 19), (102, 51, 0),
+)
+# Bits per channel of the lookup table, 5 bits is a 32x32x32 table of 32 KB
+LUT_BITS = 5
+
+
+@lru_cache(maxsize=8)
+def _palette_lut(palette):
+    # Nearest palette index for the center of every lookup table cell, green weighted like the eye
+    levels = (np.arange(1 << LUT_BITS) << (8 - LUT_BITS)) + (1 << (7 - LUT_BITS))
+    grid = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), axis=-1).reshape(-1, 1, 3)
+    weights = np.array([2.0, 4.0, 3.0])
+    distances = (((grid - np.asarray(palette)[None, :, :]) ** 2) * weights).sum(axis=2)
+    lut = distances.argmin(axis=1).astype(np.uint8)
+    return lut.reshape((1 << LUT_BITS,) * 3), np.asarray(palette, dtype=np.uint8)
+
+
+def quantize_fixed(pixels, palette=DISPLAY_PALETTE):
+    """Maps an (..., 3) uint8 array to the fixed palette with one lookup table indexing"""
+    lut, colors = _palette_lut(tuple(map(tuple, palette)))
+    shift = 8 - LUT_BITS
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    return colors[lut[pixels[..., 0] >> shift, pixels[..., 1] >> shift, pixels[..., 2] >> shift]]
+
+
+def _square_box(img):
+    # Rows of the alpha bbox and a centered square of that height, as a crop box of img
     alpha = img.split()[3]
     bbox = alpha.getbbox()  
     if bbox:
         left, upper, right, lower = bbox
-        img = img.crop((0, upper, img.width, lower))
     else:
         upper = 0
         lower = img.height
-        img = img.crop((0, 0, img.width, img.height))
 
 
     crop_h = lower - upper
@@ -28,74 +77,397 @@ def preprocess_for_16x16(path_in, path_out=None, palette_colors=8, background_co
         pad_r = diff - pad_l
         left_sq = max(0, left_sq - pad_l)
         right_sq = min(img.width, right_sq + pad_r)
-    img = img.crop((left_sq, 0, right_sq, crop_h))
-    img = img.resize((16, 16), Image.LANCZOS)
+    return (left_sq, upper, right_sq, lower)
+
+
+def to_rgb888(img, header=True):
+    """Raw RGB888 bytes of a processed image, with header the tiny raw frame header of core.rawframe comes first"""
+    rgb = img.convert("RGB").tobytes()
+    return pack_frame(rgb, img.width, img.height) if header else rgb
+
+
+def save_frame(img, path_out):
+    # ext 'rgb' writes raw frames which the display upload takes without decoding a PNG
+    if path_out.endswith('.rgb'):
+        with open(path_out, 'wb') as f:
+            f.write(to_rgb888(img))
+    else:
+        img.save(path_out)
+
+
+def _crop_square(path_in):
+
+    with Image.open(path_in) as source:
+        img = source.convert("RGBA")
+    return img.crop(_square_box(img))
 
 
-    bg = Image.new("RGB", (16, 16), background_color)
+def _finish(img, size, palette_colors, background_color, quantize='adaptive'):
+    img = img.resize((size, size), Image.LANCZOS)
+
+
+    bg = Image.new("RGB", (size, size), background_color)
     bg.paste(img, mask=img.split()[3])
 
-    img_out = bg.convert("P", palette=Image.ADAPTIVE, colors=palette_colors).convert("RGB")
+    if quantize == 'fixed':
+        return Image.fromarray(quantize_fixed(np.asarray(bg)))
+    return bg.convert("P", palette=Image.ADAPTIVE, colors=palette_colors).convert("RGB")
+
+
+def preprocess_for_16x16(path_in, path_out=None, palette_colors=8, background_color=(0,0,0), quantize='adaptive'):
+
+    img_out = _finish(_crop_square(path_in), 16, palette_colors, background_color, quantize)
     if path_out:
         img_out.save(path_out)
     return img_out
 
 
-def batch_process(input_dir='input', output_dir='output', palette_colors=8, background_color=(0,0,0), ext='png'):
+def preprocess_multi(path_in, sizes=TARGET_SIZES, palette_colors=8, background_color=(0,0,0), quantize='adaptive'):
+    """Decodes and crops once, returns {size: image} for every target size"""
+    img = _crop_square(path_in)
+    return {size: _finish(img, size, palette_colors, background_color, quantize) for size in sizes}
+
+
+MANIFEST_NAME = '.build_manifest.json'
+MANIFEST_VERSION = 1
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
+
+def _load_manifest(output_dir):
+    # Unreadable or outdated manifests just mean a full rebuild
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {'version': MANIFEST_VERSION, 'outputs': {}}
+
+
+def _save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _process_file(job):
+    # Worker of batch_process, module level so the process pool can pickle it
+    filename, infile, outfiles, palette_colors, background_color, quantize = job
+    start = time.perf_counter()
+    error = None
+    try:
+        frames = preprocess_multi(
+            infile, sizes=list(outfiles),
+            palette_colors=palette_colors,
+            background_color=background_color,
+            quantize=quantize
+        )
+        for size, outfile in outfiles.items():
+            save_frame(frames[size], outfile)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {
+        'file': filename,
+        'output': next(iter(outfiles.values())),
+        'ok': error is None,
+        'seconds': time.perf_counter() - start,
+        'error': error
+    }
+
+
+def batch_process(input_dir='input', output_dir='output', palette_colors=8, background_color=(0,0,0), ext='png', workers=1, chunksize=4, incremental=True, sizes=TARGET_SIZES, quantize='adaptive'):
+    """
+    Processes every image of input_dir into output_dir, and output_dir_for(output_dir, size) for every size.
+    workers > 1 (None for one per core) spreads the files over a process pool in chunks of chunksize.
+    A manifest in output_dir records the source hash and parameters of every output. With incremental
+    only new or changed sources are processed, outputs whose source is gone are always deleted.
+    Returns a summary with a result per processed file in sorted file name order.
+    """
     if not os.path.isdir(input_dir):
         raise FileNotFoundError(f"输入目录不存在: {input_dir}")
     os.makedirs(output_dir, exist_ok=True)
+    for size in sizes:
+        os.makedirs(output_dir_for(output_dir, size), exist_ok=True)
 
-    for filename in os.listdir(input_dir):
+    params = {
+        'palette_colors': palette_colors,
+        'background_color': list(background_color),
+        'sizes': list(sizes),
+        'ext': ext,
+        'quantize': quantize
+    }
+    start = time.perf_counter()
+    # Loaded even for full rebuilds so stale outputs are still found
+    manifest = _load_manifest(output_dir)
+    entries = manifest['outputs']
+    jobs = []
+    results = {}
+    outputs = {}
+    pending = {}
+    unchanged = 0
+    # Sorted so the same output name always comes from the same source, whatever the worker count
+    for filename in sorted(os.listdir(input_dir)):
         name, _ = os.path.splitext(filename)
         infile = os.path.join(input_dir, filename)
         if not os.path.isfile(infile) or name.startswith('.'):
             continue
-        outfile = os.path.join(output_dir, f"{name}.{ext}")
-        try:
-            preprocess_for_16x16(
-                infile, outfile,
-                palette_colors=palette_colors,
-                background_color=background_color
-            )
-            print(f"Processed: {filename} -> {os.path.basename(outfile)}")
-        except Exception as e:
-            print(f"Failed: {filename}, error: {e}")
-
-def batch_process_single_file(filename, input_dir='input', output_dir='output', palette_colors=8, background_color=(0,0,0), ext='png'):
+        output_name = f"{name}.{ext}"
+        outfile = os.path.join(output_dir, output_name)
+        outfiles = {size: os.path.join(output_dir_for(output_dir, size), output_name) for size in sizes}
+        if outfile in outputs:
+            results[filename] = {
+                'file': filename,
+                'output': outfile,
+                'ok': False,
+                'seconds': 0.0,
+                'error': f"output already produced from {outputs[outfile]}"
+            }
+            continue
+        outputs[outfile] = filename
+
+        stat = os.stat(infile)
+        entry = entries.get(output_name)
+        fresh = (
+            incremental and entry is not None
+            and entry['source'] == filename and entry['params'] == params
+            and all(os.path.exists(path) for path in outfiles.values())
+        )
+        # Size and mtime unchanged: trust the recorded hash, so a no-op run never reads the sources
+        if fresh and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            unchanged += 1
+            continue
+        digest = _file_digest(infile)
+        record = {'source': filename, 'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'params': params}
+        if fresh and entry['sha256'] == digest:
+            # Touched but not changed
+            entries[output_name] = record
+            unchanged += 1
+            continue
+        pending[filename] = (output_name, record)
+        jobs.append((filename, infile, outfiles, palette_colors, background_color, quantize))
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        processed = [_process_file(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            processed = list(pool.map(_process_file, jobs, chunksize=chunksize))
+
+    for result in processed:
+        results[result['file']] = result
+        output_name, record = pending[result['file']]
+        if result['ok']:
+            entries[output_name] = record
+            for size in sizes:
+                index_for(output_dir_for(output_dir, size)).add(output_name)
+        else:
+            # Forget failed outputs so the next run retries them
+            entries.pop(output_name, None)
+
+    # Outputs whose source disappeared (or now belongs to another source) are stale
+    removed = []
+    current = {os.path.basename(outfile) for outfile in outputs}
+    for output_name in sorted(entries):
+        if output_name not in current:
+            entry = entries.pop(output_name)
+            # Every size the output was produced in, entries of older manifests only have 16x16
+            for size in entry['params'].get('sizes', [16]):
+                try:
+                    os.remove(os.path.join(output_dir_for(output_dir, size), output_name))
+                    index_for(output_dir_for(output_dir, size)).discard(output_name)
+                except FileNotFoundError:
+                    pass
+            removed.append(output_name)
+    _save_manifest(output_dir, manifest)
+    elapsed = time.perf_counter() - start
+
+    files = [results[filename] for filename in sorted(results)]
+    succeeded = sum(1 for result in files if result['ok'])
+    return {
+        'processed': succeeded,
+        'failed': len(files) - succeeded,
+        'unchanged': unchanged,
+        'removed': removed,
+        'workers': workers,
+        'seconds': elapsed,
+        'images_per_second': succeeded / elapsed if elapsed > 0 else 0.0,
+        'files': files
+    }
+
+def batch_process_single_file(filename, input_dir='input', output_dir='output', palette_colors=8, background_color=(0,0,0), ext='png', sizes=TARGET_SIZES, quantize='adaptive'):
     string_name = filename.replace(":", "")
     
     if not os.path.isdir(input_dir):
         raise FileNotFoundError(f"输入目录不存在: {input_dir}")
     os.makedirs(output_dir, exist_ok=True)
 
-    matched_file = None
-    for file in os.listdir(input_dir):
-        name, _ = os.path.splitext(file)
-        if name == string_name:
-            matched_file = file
-            break
+    # Name lookup in the in memory index instead of listing the directory per request
+    infile = index_for(input_dir).lookup(string_name)
 
-    if not matched_file:
+    if not infile:
         print(f"No matching file found for: {string_name}")
         return
     else:
-        print(f"file has been found {matched_file}")
+        print(f"file has been found {infile}")
 
-    infile = os.path.join(input_dir, matched_file)
+    matched_file = os.path.basename(infile)
     outfile = os.path.join(output_dir, f"{string_name}.{ext}")
 
     try:
-        preprocess_for_16x16(
-            infile, outfile,
+        # One decode and crop for all display sizes
+        frames = preprocess_multi(
+            infile, sizes=sizes,
             palette_colors=palette_colors,
-            background_color=background_color
+            background_color=background_color,
+            quantize=quantize
         )
+        for size, frame in frames.items():
+            size_dir = output_dir_for(output_dir, size)
+            os.makedirs(size_dir, exist_ok=True)
+            save_frame(frame, os.path.join(size_dir, f"{string_name}.{ext}"))
+            index_for(size_dir).add(f"{string_name}.{ext}")
         print(f"Processed: {matched_file} -> {outfile}")
     except Exception as e:
         print(f"Error processing file: {e}")
 
 
+# Limits of an animation for the display, frames beyond them are dropped
+MAX_ANIMATION_FRAMES = 32
+MAX_ANIMATION_BYTES = 32 * 1024
+# Mean difference (0-255 per channel) below which consecutive frames count as the same frame
+FRAME_DIFF_THRESHOLD = 2.0
+
+
+def is_animated(data):
+    """True for image bytes with more than one frame (animated GIF, APNG, WebP)"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return bool(getattr(img, "is_animated", False))
+    except OSError:
+        return False
+
+
+def _encode_animation(frames, durations):
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:],
+                   duration=durations, loop=0, disposal=2)
+    return buffer.getvalue()
+
+
+def process_animation(path_in, sizes=TARGET_SIZES, palette_colors=8, background_color=(0,0,0), quantize='adaptive',
+                      max_frames=MAX_ANIMATION_FRAMES, max_bytes=MAX_ANIMATION_BYTES, threshold=FRAME_DIFF_THRESHOLD):
+    """
+    Processes an animated image into a GIF per display size, returned as {size: gif bytes}.
+    Frames are decoded one at a time, (nearly) identical consecutive frames are merged into one longer frame
+    and decoding stops after max_frames distinct frames. Every GIF is thinned out until it fits max_bytes.
+    """
+    sizes = sorted(sizes)
+    frames = {size: [] for size in sizes}
+    durations = []
+    box = None
+    previous = None
+    # Closed once decoded, a batch must not keep every source open (or locked on Windows)
+    with Image.open(path_in) as img:
+        for frame in ImageSequence.Iterator(img):
+            duration = frame.info.get('duration') or img.info.get('duration') or 100
+            rgba = frame.convert("RGBA")
+            # Crop of the first frame for all frames so the animation doesn't jump around
+            if box is None:
+                box = _square_box(rgba)
+            cropped = rgba.crop(box)
+            # Compared at the smallest size, the other sizes are only processed for kept frames
+            smallest = _finish(cropped, sizes[0], palette_colors, background_color, quantize)
+            pixels = np.asarray(smallest, dtype=np.int16)
+            if previous is not None and np.abs(pixels - previous).mean() < threshold:
+                durations[-1] += duration
+                continue
+            if len(durations) == max_frames:
+                break
+            previous = pixels
+            durations.append(duration)
+            frames[sizes[0]].append(smallest)
+            for size in sizes[1:]:
+                frames[size].append(_finish(cropped, size, palette_colors, background_color, quantize))
+
+    animations = {}
+    for size in sizes:
+        sized, sized_durations = frames[size], list(durations)
+        data = _encode_animation(sized, sized_durations)
+        while len(data) > max_bytes and len(sized) > 1:
+            # Drop every second frame, its time goes to the frame before
+            merged = [sum(sized_durations[i:i + 2]) for i in range(0, len(sized_durations), 2)]
+            sized, sized_durations = sized[::2], merged
+            data = _encode_animation(sized, sized_durations)
+        animations[size] = data
+    return animations
+
+
+def build_pack(input_dir='input', pack_path=DEFAULT_PACK_FILE, sizes=TARGET_SIZES, palette_colors=8, background_color=(0,0,0), quantize='adaptive', append=True):
+    """
+    Processes every image of input_dir into the emoji pack (raw RGB frames of all sizes, see emoji_pack).
+    With append the images are added to the existing pack. Returns the number of packed names.
+    """
+    if not os.path.isdir(input_dir):
+        raise FileNotFoundError(f"输入目录不存在: {input_dir}")
+
+    def entries():
+        for filename in sorted(os.listdir(input_dir)):
+            name, _ = os.path.splitext(filename)
+            infile = os.path.join(input_dir, filename)
+            if not os.path.isfile(infile) or name.startswith('.'):
+                continue
+            try:
+                frames = preprocess_multi(infile, sizes=sizes, palette_colors=palette_colors,
+                                          background_color=background_color, quantize=quantize)
+            except Exception as e:
+                print(f"Failed: {filename}, error: {e}")
+                continue
+            yield name, {size: frame.tobytes() for size, frame in frames.items()}
+
+    return write_pack(entries(), pack_path, append=append)
+
 if __name__ == '__main__':
-    batch_process()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Converts every image of the input directory for the 16x16 display")
+    parser.add_argument('--input-dir', default='input')
+    parser.add_argument('--output-dir', default='output')
+    parser.add_argument('--workers', type=int, default=0, help="number of processes, 0 for one per core")
+    parser.add_argument('--chunksize', type=int, default=4, help="files handed to a worker at a time")
+    parser.add_argument('--full', action='store_true', help="reprocess everything instead of only changed files")
+    parser.add_argument('--ext', choices=['png', 'rgb'], default='png',
+                        help="png files or raw RGB888 frames which are uploaded without a PNG decode")
+    parser.add_argument('--quantize', choices=['adaptive', 'fixed'], default='adaptive',
+                        help="adaptive palette per image or the fixed display palette")
+    parser.add_argument('--pack', nargs='?', const=DEFAULT_PACK_FILE,
+                        help="build the emoji pack (default cache/emoji.pack) instead of output files")
+    parser.add_argument('--new-pack', action='store_true', help="with --pack, replace the pack instead of appending")
+    args = parser.parse_args()
+
+    if args.pack:
+        count = build_pack(args.input_dir, args.pack, quantize=args.quantize, append=not args.new_pack)
+        print(f"Packed {count} emojis into {args.pack}")
+        raise SystemExit(0)
+
+    summary = batch_process(args.input_dir, args.output_dir, workers=args.workers, chunksize=args.chunksize,
+                            incremental=not args.full, ext=args.ext, quantize=args.quantize)
+    for result in summary['files']:
+        if result['ok']:
+            print(f"Processed: {result['file']} -> {os.path.basename(result['output'])} ({result['seconds'] * 1000:.1f} ms)")
+        else:
+            print(f"Failed: {result['file']}, error: {result['error']}")
+    for output_name in summary['removed']:
+        print(f"Removed: {output_name}")
+    print(f"{summary['processed']} processed, {summary['failed']} failed, {summary['unchanged']} unchanged, "
+          f"{len(summary['removed'])} removed in {summary['seconds']:.2f}s "
+          f"with {summary['workers']} workers ({summary['images_per_second']:.1f} images/s)")
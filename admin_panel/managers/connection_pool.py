@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from bleak import BleakClient
+
+# Writable GATT characteristic of the iDotMatrix displays (idotmatrix.const.UUID_WRITE_DATA)
+UUID_WRITE_DATA = "0000fa02-0000-1000-8000-00805f9b34fb"
+
+
+class ConnectionPool:
+    """
+    Connection pool class - Holds live bluetooth connections to several displays
+    and sends packets to many of them concurrently
+    """
+
+    def __init__(self, max_connections: int = 4, connect_timeout: float = 10.0):
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.clients: "OrderedDict[str, BleakClient]" = OrderedDict()  # Least recently used first
+        self.in_use: Dict[str, int] = {}
+        self.device_locks: Dict[str, asyncio.Lock] = {}
+        self.slots = None
+        self.pool_lock = None
+
+        # Event loop thread, all bleak clients live on this loop
+        self.loop = None
+        self.loop_thread = None
+        self.start_lock = threading.Lock()
+
+        print(f"[ConnectionPool] Connection pool initialized, max connections: {max_connections}")
+
+    def start(self):
+        """Start event loop thread"""
+        with self.start_lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+            self.loop_thread.start()
+            print("[ConnectionPool] Event loop thread started")
+
+    def run(self, coroutine, timeout: Optional[float] = None):
+        """Run a coroutine on the pool loop from any thread and wait for its result"""
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return future.result(timeout)
+
+    async def _init_primitives(self):
+        """Create asyncio primitives on the pool loop"""
+        if self.pool_lock is None:
+            self.pool_lock = asyncio.Lock()
+            self.slots = asyncio.Semaphore(self.max_connections)
+
+    async def _acquire(self, address: str) -> BleakClient:
+        """Get a connected client, evicting the least recently used idle connection if the pool is full"""
+        key = address.upper()
+        async with self.pool_lock:
+            client = self.clients.get(key)
+            if client is None:
+                while len(self.clients) >= self.max_connections:
+                    idle = next((k for k in self.clients if not self.in_use.get(k)), None)
+                    if idle is None:
+                        break
+                    evicted = self.clients.pop(idle)
+                    print(f"[ConnectionPool] Evicting connection: {idle}")
+                    try:
+                        await evicted.disconnect()
+                    except Exception as e:
+                        print(f"[ConnectionPool] Failed to disconnect {idle}: {e}")
+                client = BleakClient(address, timeout=self.connect_timeout)
+                self.clients[key] = client
+            self.clients.move_to_end(key)
+            self.in_use[key] = self.in_use.get(key, 0) + 1
+            lock = self.device_locks.setdefault(key, asyncio.Lock())
+        if not client.is_connected:
+            async with lock:
+                if not client.is_connected:
+                    await client.connect()
+                    print(f"[ConnectionPool] Connected: {address}")
+        return client
+
+    def _release(self, address: str):
+        key = address.upper()
+        self.in_use[key] = max(0, self.in_use.get(key, 1) - 1)
+
+    async def send(self, address: str, packets: Iterable[bytes], response: bool = False) -> float:
+        """Send packets to a single device, returns latency in seconds"""
+        await self._init_primitives()
+        start = time.perf_counter()
+        async with self.slots:
+            try:
+                client = await self._acquire(address)
+                async with self.device_locks[address.upper()]:
+                    chunk_size = client.services.get_characteristic(UUID_WRITE_DATA).max_write_without_response_size
+                    for packet in packets:
+                        for i in range(0, len(packet), chunk_size):
+                            await client.write_gatt_char(UUID_WRITE_DATA, packet[i:i + chunk_size], response=response)
+            except Exception:
+                # Drop broken connections so the next command reconnects
+                async with self.pool_lock:
+                    broken = self.clients.get(address.upper())
+                    if broken is not None and not broken.is_connected:
+                        self.clients.pop(address.upper())
+                raise
+            finally:
+                self._release(address)
+        return time.perf_counter() - start
+
+    async def fan_out(self, addresses: Iterable[str], packets: List[bytes], response: bool = False) -> Dict[str, Dict]:
+        """Send the same packets to all devices concurrently"""
+        await self._init_primitives()
+        addresses = list(addresses)
+
+        async def send_one(address):
+            start = time.perf_counter()
+            try:
+                latency = await self.send(address, packets, response=response)
+                return {"success": True, "latency": round(latency, 4)}
+            except Exception as e:
+                return {"success": False, "latency": round(time.perf_counter() - start, 4), "error": str(e)}
+
+        results = await asyncio.gather(*(send_one(address) for address in addresses))
+        return dict(zip(addresses, results))
+
+    def send_to_many(self, addresses: Iterable[str], packets: List[bytes], response: bool = False,
+                     timeout: Optional[float] = None) -> Dict[str, Dict]:
+        """Blocking wrapper of fan_out for threaded callers"""
+        return self.run(self.fan_out(addresses, packets, response=response), timeout)
+
+    async def _close(self):
+        await self._init_primitives()
+        async with self.pool_lock:
+            for key, client in list(self.clients.items()):
+                try:
+                    await client.disconnect()
+                except Exception as e:
+                    print(f"[ConnectionPool] Failed to disconnect {key}: {e}")
+            self.clients.clear()
+
+    def close(self):
+        """Disconnect all devices and stop the event loop thread"""
+        if self.loop is None:
+            return
+        self.run(self._close(), timeout=30)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join(timeout=5)
+        self.loop = None
+        print("[ConnectionPool] Connection pool closed")
+
+    def get_status(self) -> Dict:
+        """Get pool status"""
+        return {
+            "max_connections": self.max_connections,
+            "connections": len(self.clients),
+            "connected": [k for k, c in self.clients.items() if c.is_connected],
+        }
@@ -1,3 +1,5 @@
+import asyncio
+import io
 import json
 import os
 import subprocess
@@ -5,19 +7,38 @@ import threading
 import time
 from datetime import datetime
 from typing import Dict, List, Optional
+import Zhuanhuan
+from core.daemon_client import DaemonError, forget_frames
+from core.packet_cache import encode_image
+from admin_panel.managers.connection_pool import ConnectionPool
+
+# Packets of the supported device commands (see idotmatrix Common.screenOn / Common.screenOff)
+COMMAND_PACKETS = {
+    "turn_on": bytes([5, 0, 7, 1, 1]),
+    "turn_off": bytes([5, 0, 7, 1, 0]),
+}
+# Enables the DIY image mode before an upload (see idotmatrix Image.setMode)
+IMAGE_MODE_PACKET = bytes([5, 0, 4, 1, 1])
+# Pixel size of displays which don't specify one
+DEFAULT_DEVICE_SIZE = 16
 
 class DeviceManager:
     """Device management class: manages device CRUD and status monitoring"""
     """This class requires the administrator to manually enter device information"""
     
-    def __init__(self, config_file: str = None):
+    def __init__(self, config_file: str = None, max_connections: int = 4, groups_file: str = None):
         import os
         data_dir = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'data'))
         self.config_file = config_file or os.path.join(data_dir, "devices.json")
+        self.groups_file = groups_file or os.path.join(os.path.dirname(self.config_file), "device_groups.json")
         self.devices = {}
+        self.groups = {}  # Group name -> list of device IDs
         self.status_thread = None
         self.monitoring = False
+        # Live bluetooth connections, capped to what the adapter supports
+        self.connection_pool = ConnectionPool(max_connections=max_connections)
         self.load_devices()
+        self.load_groups()
         
     def load_devices(self):
         """Load device list from config file"""
@@ -41,6 +62,27 @@ class DeviceManager:
         except Exception as e:
             print(f"Failed to save device config: {e}")
     
+    def load_groups(self):
+        """Load device groups from groups file"""
+        try:
+            if os.path.exists(self.groups_file):
+                with open(self.groups_file, 'r', encoding='utf-8') as f:
+                    self.groups = json.load(f)
+                print(f"Loaded {len(self.groups)} device groups")
+            else:
+                self.groups = {}
+        except Exception as e:
+            print(f"Failed to load device groups: {e}")
+            self.groups = {}
+    
+    def save_groups(self):
+        """Save device groups to groups file"""
+        try:
+            with open(self.groups_file, 'w', encoding='utf-8') as f:
+                json.dump(self.groups, f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            print(f"Failed to save device groups: {e}")
+    
     def add_device(self, device_id: str, device_info: Dict) -> bool:
         """
         Add new device
@@ -59,6 +101,7 @@ class DeviceManager:
                 "ip": device_info.get("ip", ""),
                 "mac": device_info.get("mac", ""),
                 "type": device_info.get("type", "pixel_display"),
+                "size": int(device_info.get("size", DEFAULT_DEVICE_SIZE)),
                 "enabled": device_info.get("enabled", True),
                 "status": "unknown",  # online/offline/unknown
                 "last_seen": None,
@@ -84,6 +127,12 @@ class DeviceManager:
             
             del self.devices[device_id]
             self.save_devices()
+            
+            # Remove device from all groups
+            for members in self.groups.values():
+                if device_id in members:
+                    members.remove(device_id)
+            self.save_groups()
             print(f"Device {device_id} removed successfully")
             return True
             
@@ -100,7 +149,7 @@ class DeviceManager:
             
             # Update device info
             for key, value in device_info.items():
-                if key in ["name", "ip", "mac", "type", "enabled"]:
+                if key in ["name", "ip", "mac", "type", "enabled", "size"]:
                     self.devices[device_id][key] = value
             
             self.devices[device_id]["updated_at"] = datetime.now().isoformat()
@@ -238,41 +287,211 @@ class DeviceManager:
     
     def send_command_to_device(self, device_id: str, command: str) -> bool:
         """Send special command to device (turn on/off etc.)"""
+        return self.send_command_to_devices([device_id], command).get(device_id, False)
+    
+    def send_command_to_devices(self, device_ids: List[str], command: str) -> Dict[str, bool]:
+        """Send special command to several devices concurrently over the connection pool"""
+        results = {}
         try:
-            device = self.devices.get(device_id)
-            if not device:
-                print(f"Device {device_id} doesn't exist")
-                return False
+            packet = COMMAND_PACKETS.get(command)
+            if packet is None:
+                print(f"Unknown command: {command}")
+                return {device_id: False for device_id in device_ids}
             
-            if not device.get("enabled", True):
-                print(f"Device {device_id} is disabled")
-                return False
+            # Resolve target MAC addresses
+            targets = {}
+            for device_id in device_ids:
+                device = self.devices.get(device_id)
+                if not device:
+                    print(f"Device {device_id} doesn't exist")
+                    results[device_id] = False
+                elif not device.get("enabled", True):
+                    print(f"Device {device_id} is disabled")
+                    results[device_id] = False
+                elif not device.get("mac"):
+                    print(f"Device {device_id} has no MAC address")
+                    results[device_id] = False
+                else:
+                    targets[device_id] = device["mac"]
             
-            mac_address = device.get("mac")
-            if not mac_address:
-                print(f"Device {device_id} has no MAC address")
+            if targets:
+                # All devices are written at the same time instead of one after another,
+                # devices registered with the same MAC share one write
+                report = self.connection_pool.send_to_many(list(dict.fromkeys(targets.values())), [packet])
+                for device_id, mac_address in targets.items():
+                    result = report.get(mac_address, {"success": False, "error": "no result"})
+                    results[device_id] = result["success"]
+                    if result["success"]:
+                        print(f"Command {command} executed successfully for device {device_id} ({result['latency']}s)")
+                    else:
+                        print(f"Failed to execute device command for {device_id}: {result['error']}")
+            return results
+            
+        except Exception as e:
+            print(f"Error sending command to devices: {e}")
+            return {device_id: results.get(device_id, False) for device_id in device_ids}
+    
+    def send_command_to_all(self, command: str) -> Dict[str, bool]:
+        """Send special command to all enabled devices concurrently"""
+        return self.send_command_to_devices(list(self.get_enabled_devices().keys()), command)
+    
+    def create_group(self, group_name: str, device_ids: List[str] = None) -> bool:
+        """Create named device group"""
+        try:
+            if group_name in self.groups:
+                print(f"Group {group_name} already exists")
                 return False
             
-            # Execute different operations based on command type
-            if command == "turn_on":
-                cmd = f"python .\\app.py --address {mac_address} --screen on"
-            elif command == "turn_off":
-                cmd = f"python .\\app.py --address {mac_address} --screen off"
-            else:
-                print(f"Unknown command: {command}")
+            unknown = [d for d in (device_ids or []) if d not in self.devices]
+            if unknown:
+                print(f"Devices don't exist: {', '.join(unknown)}")
                 return False
             
-            result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
-            print(f"Command {command} executed successfully for device {device_id}")
+            self.groups[group_name] = list(dict.fromkeys(device_ids or []))
+            self.save_groups()
+            print(f"Group {group_name} created with {len(self.groups[group_name])} devices")
             return True
             
-        except subprocess.CalledProcessError as e:
-            print(f"Failed to execute device command: {e}")
-            return False
         except Exception as e:
-            print(f"Error sending command to device: {e}")
+            print(f"Failed to create group: {e}")
             return False
     
+    def delete_group(self, group_name: str) -> bool:
+        """Delete device group (devices are kept)"""
+        if group_name not in self.groups:
+            print(f"Group {group_name} doesn't exist")
+            return False
+        
+        del self.groups[group_name]
+        self.save_groups()
+        print(f"Group {group_name} deleted")
+        return True
+    
+    def add_device_to_group(self, group_name: str, device_id: str) -> bool:
+        """Add device to group, the group is created if needed"""
+        if device_id not in self.devices:
+            print(f"Device {device_id} doesn't exist")
+            return False
+        
+        members = self.groups.setdefault(group_name, [])
+        if device_id not in members:
+            members.append(device_id)
+            self.save_groups()
+        print(f"Device {device_id} added to group {group_name}")
+        return True
+    
+    def remove_device_from_group(self, group_name: str, device_id: str) -> bool:
+        """Remove device from group"""
+        members = self.groups.get(group_name)
+        if not members or device_id not in members:
+            print(f"Device {device_id} is not in group {group_name}")
+            return False
+        
+        members.remove(device_id)
+        self.save_groups()
+        print(f"Device {device_id} removed from group {group_name}")
+        return True
+    
+    def get_group(self, group_name: str) -> Optional[List[str]]:
+        """Get device IDs of a group"""
+        members = self.groups.get(group_name)
+        return list(members) if members is not None else None
+    
+    def get_all_groups(self) -> Dict:
+        """Get all groups"""
+        return {name: list(members) for name, members in self.groups.items()}
+    
+    def _encode_broadcast_image(self, image_path: str, sizes: List[int], **process_args) -> Dict[int, List[bytes]]:
+        """Decode the image once, process a variant per display size and encode its upload packets once"""
+        frames = Zhuanhuan.preprocess_multi(image_path, sizes=sizes, **process_args)
+        return self._encode_broadcast_frames(frames, sizes)
+    
+    def _encode_broadcast_frames(self, frames: Dict, sizes: List[int]) -> Dict[int, List[bytes]]:
+        """Encode the upload packets of already processed frames ({size: image}) once per display size"""
+        missing = [size for size in sizes if size not in frames]
+        if missing:
+            raise ValueError(f"no {missing} variant of the frames")
+        if any(isinstance(frames[size], bytes) for size in sizes):
+            raise ValueError("animated emojis can't be broadcast as an image")
+        packets = {}
+        for size in sizes:
+            frame = frames[size]
+            buffer = io.BytesIO()
+            frame.save(buffer, format="PNG")
+            packets[size] = [IMAGE_MODE_PACKET] + encode_image(buffer.getvalue())
+        return packets
+    
+    def _forget_daemon_frames(self, mac_addresses: List[str]):
+        """Make the display daemon forget the frames it last sent, the broadcast drew over them"""
+        try:
+            forget_frames(mac_addresses)
+        except DaemonError as e:
+            # Without a running daemon there is no frame model to clear
+            print(f"Display daemon not updated after broadcast: {e}")
+    
+    def broadcast_image(self, group_name: str, image_path: Optional[str] = None, frames: Optional[Dict] = None, **process_args) -> Dict:
+        """
+        Show the same image on every device of a group
+        :param group_name: Group name
+        :param image_path: Source image, processed through Zhuanhuan once
+        :param frames: Already processed frames ({size: image}, e.g. from the EmojiStore) instead of image_path
+        :param process_args: palette_colors / background_color passed to Zhuanhuan
+        :return: Per-device success/latency report
+        """
+        start = time.perf_counter()
+        report = {"group": group_name, "devices": {}}
+        members = self.groups.get(group_name)
+        if members is None:
+            report["error"] = f"Group {group_name} doesn't exist"
+            print(report["error"])
+            return report
+        
+        # Resolve reachable group members
+        targets = {}
+        for device_id in members:
+            device = self.devices.get(device_id)
+            if not device or not device.get("enabled", True) or not device.get("mac"):
+                report["devices"][device_id] = {"success": False, "error": "device missing, disabled or without MAC address"}
+                continue
+            targets[device_id] = device
+        
+        try:
+            sizes = sorted({int(d.get("size", DEFAULT_DEVICE_SIZE)) for d in targets.values()})
+            if frames is not None:
+                packets = self._encode_broadcast_frames(frames, sizes)
+            else:
+                packets = self._encode_broadcast_image(image_path, sizes, **process_args)
+        except Exception as e:
+            report["error"] = f"Failed to process image: {e}"
+            print(report["error"])
+            return report
+        report["encode_seconds"] = round(time.perf_counter() - start, 4)
+        
+        # One concurrent fan-out per display size, all sizes at the same time
+        async def send_all():
+            jobs = []
+            for size in sizes:
+                group = [d for d in targets.values() if int(d.get("size", DEFAULT_DEVICE_SIZE)) == size]
+                jobs.append(self.connection_pool.fan_out([d["mac"] for d in group], packets[size]))
+            merged = {}
+            for result in await asyncio.gather(*jobs):
+                merged.update(result)
+            return merged
+        
+        if targets:
+            try:
+                results = self.connection_pool.run(send_all())
+            finally:
+                self._forget_daemon_frames([d["mac"] for d in targets.values()])
+            for device_id, device in targets.items():
+                report["devices"][device_id] = results.get(device["mac"], {"success": False, "error": "no result"})
+        
+        report["succeeded"] = sum(1 for r in report["devices"].values() if r["success"])
+        report["failed"] = len(report["devices"]) - report["succeeded"]
+        report["total_seconds"] = round(time.perf_counter() - start, 4)
+        print(f"Broadcast to group {group_name}: {report['succeeded']} succeeded, {report['failed']} failed")
+        return report
+    
     def get_device_statistics(self) -> Dict:
         """Get device statistics"""
         total = len(self.devices)
@@ -290,6 +509,13 @@ class DeviceManager:
             "unknown": unknown
         }
 
+    def get_status(self) -> Dict:
+        """Get device manager status including live connections"""
+        return {
+            "statistics": self.get_device_statistics(),
+            "connection_pool": self.connection_pool.get_status()
+        }
+
 # Usage example
 if __name__ == "__main__":
     dm = DeviceManager()
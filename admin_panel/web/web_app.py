@@ -1,5 +1,6 @@
 from flask import Flask, Blueprint, render_template_string, request, jsonify, redirect, url_for, Response
 admin_bp = Blueprint('admin', __name__)
+import os
 import threading
 import time
 from datetime import datetime
@@ -7,6 +8,7 @@ from admin_panel.managers.device_manager import DeviceManager
 from admin_panel.managers.task_queue import TaskQueueManager, TaskPriority
 from admin_panel.managers.user_manager import UserManager
 from admin_panel.managers.admin_manager import AdminManager
+from emoji_store import EmojiStore
 
 app = Flask(__name__)
 
@@ -15,6 +17,11 @@ device_manager     = DeviceManager()
 task_queue_manager = TaskQueueManager()
 user_manager       = UserManager()
 admin_manager      = AdminManager(port=9999)
+# Processed emojis stored by the Slack app, shared through the store directory
+emoji_store        = EmojiStore()
+# The only directories group broadcasts may read images from
+PROJECT_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+BROADCAST_IMAGE_DIRS = [os.path.join(PROJECT_DIR, 'input'), os.path.join(PROJECT_DIR, 'output')]
 # If using InterfaceManager:
 # from admin_panel.managers.interface_manager import interface_manager
 # admin_manager.set_components(interface_manager, task_queue_manager, user_manager, device_manager)
@@ -42,6 +49,10 @@ TEMPLATE = '''
       <!-- Device Management -->
       <div class="col-12 col-md-6">
         <h2 class="h4">Device Management</h2>
+        <div class="btn-group btn-group-sm mb-2">
+          <a href="{{ url_for('api_command_all_devices', command='turn_on') }}" class="btn btn-outline-success">All On</a>
+          <a href="{{ url_for('api_command_all_devices', command='turn_off') }}" class="btn btn-outline-secondary">All Off</a>
+        </div>
         <ul class="list-group">
         {% for id, dev in devices.items() %}
           <li class="list-group-item d-flex justify-content-between align-items-center">
@@ -157,6 +168,12 @@ def toggle_device_power(device_id):
     success = device_manager.toggle_power(device_id)
     return redirect(url_for('dashboard'))
 
+@admin_bp.route('/api/devices/<command>')
+def api_command_all_devices(command):
+    # turn_on / turn_off on every enabled device at once
+    device_manager.send_command_to_all(command)
+    return redirect(url_for('dashboard'))
+
 @admin_bp.route('/api/device/disable/<device_id>')
 def api_disable_device(device_id):
     device_manager.disable_device(device_id)
@@ -167,6 +184,45 @@ def api_remove_device(device_id):
     device_manager.remove_device(device_id)
     return redirect(url_for('dashboard'))
 
+@admin_bp.route('/api/group/<group_name>', methods=['POST'])
+def api_create_group(group_name):
+    data = request.get_json(silent=True) or {}
+    success = device_manager.create_group(group_name, data.get('devices', []))
+    return jsonify({'success': success, 'groups': device_manager.get_all_groups()})
+
+def broadcast_image_path(image):
+    """Resolve an image of the request to a file under input/ or output/, None for anything else"""
+    if not image:
+        return None
+    path = os.path.realpath(os.path.join(PROJECT_DIR, image))
+    for directory in BROADCAST_IMAGE_DIRS:
+        directory = os.path.realpath(directory)
+        try:
+            inside = os.path.commonpath([path, directory]) == directory
+        except ValueError:
+            # Another drive on Windows
+            inside = False
+        if inside and os.path.isfile(path):
+            return path
+    return None
+
+@admin_bp.route('/api/group/<group_name>/broadcast', methods=['POST'])
+def api_broadcast_group(group_name):
+    data = request.get_json(silent=True) or request.form.to_dict()
+    if data.get('emoji'):
+        # Emojis received through Slack only exist as processed frames in the emoji store
+        emoji_name = data['emoji'].replace(':', '')
+        frames = emoji_store.get(emoji_name)
+        if frames is None:
+            return jsonify({'error': f'Emoji not found: {emoji_name}'}), 404
+        report = device_manager.broadcast_image(group_name, frames=frames)
+        return jsonify(report), (400 if 'error' in report else 200)
+    image_path = broadcast_image_path(data.get('image'))
+    if image_path is None:
+        return jsonify({'error': f"Image not found in input/ or output/: {data.get('image')}"}), 404
+    report = device_manager.broadcast_image(group_name, image_path)
+    return jsonify(report), (400 if 'error' in report else 200)
+
 @admin_bp.route('/api/user/block/<username>')
 def api_block_user(username):
     user_manager.block_user(username)
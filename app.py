@@ -11,7 +11,6 @@ from task_functions import (
     sync_time
 )
 # python imports
-import argparse
 import asyncio
 import logging
 
@@ -113,17 +112,8 @@ def log():
 
 def main():
     cmd = CMD()
-    parser = argparse.ArgumentParser(
-        description="control all your 16x16 or 32x32 pixel displays"
-    )
-    # global argument
-    parser.add_argument(
-        "--address",
-        action="store",
-        help="the bluetooth address of the device",
-    )
-    # add cmd arguments
-    cmd.add_arguments(parser)
+    # create parser with global and cmd arguments
+    parser = cmd.create_parser()
     # parse arguments
     args = parser.parse_args()
     # run command
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import deque
+
+# One coalescer per display address
+_coalescers = {}
+_coalescers_lock = threading.Lock()
+
+
+class CommandCoalescer:
+    """
+    Runs the commands of one display on a single worker thread.
+    Content updates (emoji, images) which haven't started yet are superseded by a newer one,
+    other commands (timer, sleep, awake) always run in the order they were sent.
+    """
+
+    def __init__(self, name="display"):
+        self.name = name
+        self.jobs = deque()
+        self.condition = threading.Condition()
+        self.stats = {
+            'submitted': 0,
+            'superseded': 0,
+            'executed': 0,
+            'failed': 0
+        }
+        self.worker = threading.Thread(target=self._worker_loop, daemon=True)
+        self.worker.start()
+
+    def submit(self, label, func, *args, content=False):
+        """Queue a command, a content update replaces the queued content updates after the last other command"""
+        with self.condition:
+            if content:
+                # Only trailing content updates are dropped so ordering around other commands is kept
+                while self.jobs and self.jobs[-1]['content']:
+                    superseded = self.jobs.pop()
+                    self.stats['superseded'] += 1
+                    print(f"[CommandCoalescer] {superseded['label']} superseded by {label}")
+            self.jobs.append({'label': label, 'func': func, 'args': args, 'content': content, 'queued_at': time.time()})
+            self.stats['submitted'] += 1
+            self.condition.notify()
+
+    def submit_content(self, label, func, *args):
+        """Queue a content update (latest wins)"""
+        self.submit(label, func, *args, content=True)
+
+    def _worker_loop(self):
+        while True:
+            with self.condition:
+                while not self.jobs:
+                    self.condition.wait()
+                job = self.jobs.popleft()
+            try:
+                job['func'](*job['args'])
+                self.stats['executed'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                print(f"[CommandCoalescer] {job['label']} failed: {e}")
+
+    def get_status(self):
+        with self.condition:
+            return {**self.stats, 'pending': [job['label'] for job in self.jobs]}
+
+
+def coalescer_for(device):
+    """Get the coalescer of a display, created on first use"""
+    key = str(device).upper()
+    with _coalescers_lock:
+        if key not in _coalescers:
+            _coalescers[key] = CommandCoalescer(name=key)
+        return _coalescers[key]
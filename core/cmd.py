@@ -1,10 +1,21 @@
 # python imports
+import argparse
+import asyncio
 from datetime import datetime
+import json
 import logging
 import os
+import sys
 import time
+import numpy
 import utils
 from idotmatrix import *
+from core.graffiti import BatchedGraffiti
+from core.framediff import FrameStore, lazy_frame, payload_png_size
+from core.packet_cache import PacketCache
+from core.rawframe import check_frame, is_raw_frame, unpack_frame
+from core.stream import FrameStreamer, read_frames
+from core.upload import UploadEngine
 
 
 
@@ -24,8 +35,24 @@ from idotmatrix import *
 
 class CMD:
     conn = ConnectionManager()
+    frames = FrameStore()
+    packets = PacketCache()
     logging = logging.getLogger("idotmatrix." + __name__)
 
+    def create_parser(self):
+        """creates the argument parser shared by app.py and the display daemon"""
+        parser = argparse.ArgumentParser(
+            description="control all your 16x16 or 32x32 pixel displays"
+        )
+        # global argument
+        parser.add_argument(
+            "--address",
+            action="store",
+            help="the bluetooth address of the device",
+        )
+        self.add_arguments(parser)
+        return parser
+
     def add_arguments(self, parser):
         # scan
         parser.add_argument(
@@ -33,6 +60,12 @@ class CMD:
             action="store_true",
             help="scans all bluetooth devices in range for iDotMatrix displays",
         )
+        # batch
+        parser.add_argument(
+            "--batch",
+            action="store",
+            help="runs the commands of a JSON-lines file ('-' = stdin) in order over one connection. Format per line: {\"args\": [\"--screen\", \"on\"], \"delay\": 0.5}",
+        )
         # test
         parser.add_argument(
             "--test",
@@ -48,8 +81,7 @@ class CMD:
         parser.add_argument(
             "--set-time",
             action="store",
-            help="optionally set time to sync to device (use with --sync-time)",
-            default=datetime.now().strftime("%d-%m-%Y-%H:%M:%S"),
+            help="optionally set time to sync to device (use with --sync-time). Defaults to the current time",
         )
         # device screen rotation
         parser.add_argument(
@@ -137,6 +169,11 @@ class CMD:
             help="sets a pixel to a specific color. Could be used multiple times. Format: <PIXEL-X>-<PIXEL-Y>-<R0-255>-<G0-255>-<B0-255> (example: 0-0-255-255-255)",
             nargs="+",
         )
+        parser.add_argument(
+            "--no-pixel-batch",
+            action="store_true",
+            help="sends every pixel of --pixel-color as a separate write instead of batching them by color up to the MTU size",
+        )
         # scoreboard
         parser.add_argument(
             "--scoreboard",
@@ -170,6 +207,27 @@ class CMD:
             action="store",
             help="processes the gif instead of sending it raw (useful when the size does not match). Format: <AMOUNT_PIXEL>",
         )
+        parser.add_argument(
+            "--upload-window",
+            action="store",
+            type=int,
+            help="number of gif chunks sent ahead of the device acknowledgements. 0 = acknowledged writes only. Defaults to 4.",
+            default=4,
+        )
+        # frame stream
+        parser.add_argument(
+            "--stream",
+            action="store",
+            nargs="+",
+            help="streams images (every frame of a gif) to the display, sending only changed pixels where that is cheaper. Scaled with '--process-image'. Format: ./path/to/frame1.png ./path/to/frame2.png",
+        )
+        parser.add_argument(
+            "--stream-fps",
+            action="store",
+            type=float,
+            help="frames per second of --stream, late frames are dropped. Defaults to 10.",
+            default=10.0,
+        )
         # text upload
         parser.add_argument(
             "--set-text",
@@ -275,9 +333,13 @@ class CMD:
             await self.conn.connectBySearch()
         else:
             await self.conn.connectByAddress(address)
+        if args.batch:
+            await self.batch(args.batch)
+            return
         # arguments which can be run in parallel
         if args.sync_time:
-            await self.sync_time(args.set_time)
+            # resolved per run, a parser shared by the daemon or a batch lives much longer than one command
+            await self.sync_time(args.set_time or datetime.now().strftime("%d-%m-%Y-%H:%M:%S"))
         if args.flip_screen:
             await self.flip_screen(args.flip_screen)
         if args.toggle_screen_freeze:
@@ -290,6 +352,12 @@ class CMD:
             await self.set_password(args.set_password)
         if args.reset:
             await self.reset(args)
+        # anything but an image upload changes what the display shows
+        if args.reset or args.test or args.chronograph or args.clock or args.countdown \
+                or args.fullscreen_color or args.pixel_color or args.scoreboard \
+                or args.image == "false" or args.set_gif or args.set_text \
+                or args.weather_image_query or args.weather_gif_query:
+            self.frames.invalidate(self.conn.address)
         # arguments which cannot run in parallel
         if args.test:
             await self.test()
@@ -302,13 +370,15 @@ class CMD:
         elif args.fullscreen_color:
             await self.fullscreenColor(args.fullscreen_color)
         elif args.pixel_color:
-            await self.pixelColor(args.pixel_color)
+            await self.pixelColor(args.pixel_color, batched=not args.no_pixel_batch)
         elif args.scoreboard:
             await self.scoreboard(args.scoreboard)
         elif args.image:
             await self.image(args)
         elif args.set_gif:
             await self.gif(args)
+        elif args.stream:
+            await self.stream(args)
         elif args.set_text:
             await self.text(args)
         elif args.weather_image_query:
@@ -316,6 +386,54 @@ class CMD:
         elif args.weather_gif_query:
             await self.weather_gif_query(args)
 
+    async def batch(self, file_path):
+        """runs a JSON-lines script of commands back-to-back over the current connection"""
+        self.logging.info(f"running batch {file_path}")
+        parser = self.create_parser()
+        if file_path == "-":
+            lines = sys.stdin.readlines()
+        else:
+            with open(file_path, "r", encoding="utf-8") as file:
+                lines = file.readlines()
+        timings = []
+        for number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            start = time.perf_counter()
+            success = False
+            step = None
+            try:
+                step = json.loads(line)
+                # a plain list is shorthand for {"args": [...]}
+                if isinstance(step, list):
+                    step = {"args": step}
+                step_args = parser.parse_args([str(arg) for arg in step["args"]])
+                if step_args.batch or step_args.scan:
+                    raise ValueError("--batch and --scan are not allowed inside a batch")
+                # every step reuses the connection of the batch
+                step_args.address = step_args.address or self.conn.address
+                await self.run(step_args)
+                success = True
+            except SystemExit:
+                self.logging.error(f"batch line {number}: command aborted")
+            except Exception as e:
+                self.logging.error(f"batch line {number}: {e}")
+            elapsed = time.perf_counter() - start
+            timings.append((number, success, elapsed))
+            self.logging.info(
+                f"batch line {number}: {'ok' if success else 'failed'} in {elapsed * 1000:.0f} ms"
+            )
+            delay = float(step.get("delay", 0)) if isinstance(step, dict) else 0
+            if delay > 0:
+                await asyncio.sleep(delay)
+        total = sum(elapsed for _, _, elapsed in timings)
+        failed = sum(1 for _, success, _ in timings if not success)
+        self.logging.info(
+            f"batch finished: {len(timings)} steps, {failed} failed, {total * 1000:.0f} ms spent in commands"
+        )
+        return timings
+
     async def test(self):
         """Tests all available options for the device"""
         self.logging.info("starting test of device")
@@ -490,7 +608,7 @@ class CMD:
             color[2],
         )
 
-    async def pixelColor(self, argument):
+    async def pixelColor(self, argument, batched=True):
         """sets the given pixel colors"""
         self.logging.info("setting pixel color")
         if len(argument) <= 0:
@@ -501,7 +619,8 @@ class CMD:
         for params in argument:
             for pixel in params:
                 pixels.append(pixel)
-        # validate all pixels and send them
+        # validate all pixels
+        parsed = []
         for pixel in pixels:
             split = pixel.split("-")
             # check if we got all data
@@ -510,16 +629,20 @@ class CMD:
                     "need exactly 5 arguments for a single pixel in --pixel-color"
                 )
                 quit()
+            values = [int(value) for value in split]
             # TODO: proper check if we are within the pixel range of the device
-            # TODO: maybe we can use a delimiter to make use of the MTU size (sending chunks instead of separate requests)
-            # TODO: when filling 32x32 pixels it seems to have trouble to send all pixels. One pixel will be "forgotten" somehow
-            await Graffiti().setPixel(
-                x=int(split[0]),
-                y=int(split[1]),
-                r=int(split[2]),
-                g=int(split[3]),
-                b=int(split[4]),
-            )
+            if any(value not in range(0, 256) for value in values):
+                self.logging.error(
+                    "values of a single pixel in --pixel-color must be between 0 and 255"
+                )
+                quit()
+            parsed.append(tuple(values))
+        # send pixels of the same color together, sized to the MTU of the connection
+        if batched:
+            await BatchedGraffiti().setPixels(parsed)
+            return
+        for x, y, r, g, b in parsed:
+            await Graffiti().setPixel(x=x, y=y, r=r, g=g, b=b)
 
     async def scoreboard(self, argument):
         """sets given score on the scoreboard and shows it"""
@@ -552,29 +675,111 @@ class CMD:
                 mode=1,
             )
             if args.set_image:
-                if args.process_image:
-                    await image.uploadProcessed(
-                        file_path=args.set_image,
-                        pixel_size=int(args.process_image),
-                    )
+                pixel_size = int(args.process_image) if args.process_image else None
+                try:
+                    with open(args.set_image, "rb") as file:
+                        source = file.read()
+                    if is_raw_frame(source):
+                        # raw frames from Zhuanhuan are already display ready, no decode needed
+                        rgb, width, height = unpack_frame(source)
+                        if width != height:
+                            raise ValueError(f"raw frame of {width}x{height} is not square")
+                        await self.frame(rgb, width)
+                        return
+                    frame = lazy_frame(source, pixel_size)
+
+                    def png_size():
+                        # the png actually sent (resized by --process-image), only encoded if the diff needs it
+                        return payload_png_size(len(self.packets.image(source, pixel_size)[0]))
+
+                    if await self.image_diff(frame, png_size):
+                        return
+                    # pre-encoded packets are cached by content, pixel size and mode
+                    payload = self.packets.image(source, pixel_size)
+                    uploaded = await self.conn.send(data=payload[0])
+                except Exception as error:
+                    self.logging.error(f"could not upload the image: {error}")
+                    uploaded = False
+                self.logging.debug(f"packet cache: {self.packets.stats()}")
+                if uploaded:
+                    self.frames.set(self.conn.address, frame)
                 else:
-                    await image.uploadUnprocessed(
-                        file_path=args.set_image,
-                    )
+                    self.frames.invalidate(self.conn.address)
+
+    async def image_diff(self, frame, png_size):
+        """sends only the changed pixels if the display already shows a similar frame"""
+        batched = BatchedGraffiti()
+        pixels = self.frames.plan(
+            self.conn.address, frame, png_size, await batched.write_size()
+        )
+        if pixels is None:
+            return False
+        self.logging.info(f"updating {len(pixels)} changed pixels instead of uploading the image")
+        if pixels:
+            await batched.setPixels(pixels)
+        self.frames.set(self.conn.address, frame)
+        return True
+
+    async def frame(self, rgb: bytes, size: int):
+        """shows a raw RGB frame of size x size pixels, e.g. straight from the Zhuanhuan pipeline"""
+        self.logging.info("setting frame")
+        check_frame(rgb, size)
+        await Image().setMode(mode=1)
+        frame = numpy.frombuffer(rgb, dtype=numpy.uint8).reshape(size, size, 3)
+        try:
+            def png_size():
+                # the only encode of the frame, a PNG is what the device expects, skipped if the diff is cheap anyway
+                return payload_png_size(len(self.packets.frame(rgb, size)[0]))
+
+            if await self.image_diff(frame, png_size):
+                return
+            payload = self.packets.frame(rgb, size)
+            if not await self.conn.send(data=payload[0]):
+                raise ConnectionError("the display is not connected")
+        except Exception as error:
+            # the display shows an unknown frame now, callers need to know the upload failed
+            self.logging.error(f"could not upload the frame: {error}")
+            self.frames.invalidate(self.conn.address)
+            raise
+        self.frames.set(self.conn.address, frame)
 
     async def gif(self, args):
         """enables or disables the gif mode and uploads a given gif file"""
         self.logging.info("setting (animated) GIF")
-        gif = Gif()
-        if args.process_gif:
-            await gif.uploadProcessed(
-                file_path=args.set_gif,
-                pixel_size=int(args.process_gif),
-            )
-        else:
-            await gif.uploadUnprocessed(
-                file_path=args.set_gif,
-            )
+        pixel_size = int(args.process_gif) if args.process_gif else None
+        try:
+            with open(args.set_gif, "rb") as file:
+                source = file.read()
+        except OSError as error:
+            self.logging.error(f"could not read the gif: {error}")
+            return
+        await self.gif_data(source, pixel_size, args.upload_window)
+
+    async def gif_data(self, source: bytes, pixel_size=None, window: int = 4):
+        """uploads gif bytes, e.g. an animated emoji processed in memory"""
+        try:
+            # pre-encoded packets are cached by content, pixel size and mode
+            chunks = self.packets.gif(source, pixel_size)
+            # chunks are streamed without response, flow controlled by device notifications
+            await UploadEngine(window=window).upload(chunks)
+        except Exception as error:
+            self.logging.error(f"could not upload the gif: {error}")
+            raise
+        finally:
+            self.logging.debug(f"packet cache: {self.packets.stats()}")
+            # an animation (or a broken upload) replaces whatever frame the display showed
+            self.frames.invalidate(self.conn.address)
+
+    async def stream(self, args):
+        """streams the given image files to the device at --stream-fps"""
+        self.logging.info("streaming frames")
+        pixel_size = int(args.process_image) if args.process_image else None
+        streamer = FrameStreamer(fps=args.stream_fps, pixel_size=pixel_size, frames=self.frames)
+        try:
+            return await streamer.stream(read_frames(args.stream))
+        except Exception as error:
+            self.logging.error(f"could not stream the frames: {error}")
+            raise
 
     async def text(self, args):
         """sets the given text on the device"""
@@ -0,0 +1,247 @@
+# python imports
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+# idotmatrix imports
+from core.cmd import CMD
+from core.daemon_client import DEFAULT_HOST, DEFAULT_PORT, MAX_REQUEST_BYTES
+from core.link import LinkKeeper
+from core.rawframe import check_frame
+
+
+class DisplayDaemon:
+    """Long-lived display service.
+
+    Keeps a single bluetooth connection to the display open and executes
+    app.py style commands sent as JSON lines over a local TCP socket, so a
+    command no longer pays for a new interpreter, the imports and a reconnect.
+    The connection is kept warm with keepalives and reconnected in the
+    background when it drops.
+
+    Request:  {"args": ["--screen", "on"]}
+    Reply:    {"status": "ok", "elapsed": 0.12}
+
+    Request:  {"frame": "<base64 RGB bytes>", "size": 16, "address": "..."}
+    Reply:    {"status": "ok", "elapsed": 0.08}
+
+    Request:  {"gif": "<base64 GIF bytes>", "address": "..."}
+    Reply:    {"status": "ok", "elapsed": 0.9}
+
+    Request:  {"forget": ["AA:BB:CC:DD:EE:FF", ...]}
+    Reply:    {"status": "ok"}
+
+    Request:  {"stats": true}
+    Reply:    {"status": "ok", "stats": {...}}
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(
+        self,
+        address: Optional[str] = None,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+    ) -> None:
+        self.cmd = CMD()
+        self.parser = self.cmd.create_parser()
+        self.address = address
+        self.host = host
+        self.port = port
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.ready = threading.Event()
+        self.lock: Optional[asyncio.Lock] = None
+        self.link: Optional[LinkKeeper] = None
+        self.stats = {
+            "started_at": None,
+            "commands": 0,
+            "failed": 0,
+        }
+
+    async def execute(self, argv: List[str]) -> Dict:
+        """parses and runs a single command over the shared connection"""
+        start = time.perf_counter()
+        try:
+            args = self.parser.parse_args(argv)
+        except SystemExit:
+            self.stats["failed"] += 1
+            return {"status": "error", "message": f"invalid arguments: {argv}"}
+        if args.batch:
+            # a batch reads a file (or the daemon's own stdin for -) and would block the event loop
+            self.stats["failed"] += 1
+            return {"status": "error", "message": "--batch is not supported by the daemon, send the commands one by one"}
+        if not args.address:
+            args.address = self.address
+        async with self.lock:
+            try:
+                await self.link.ensure(args.address)
+                await self.cmd.run(args)
+                self.address = args.address or self.address
+            except SystemExit:
+                # CMD.run calls quit() after a scan and on invalid arguments
+                if not args.scan:
+                    self.stats["failed"] += 1
+                    return {"status": "error", "message": "command aborted, see daemon log"}
+            except Exception as e:
+                self.stats["failed"] += 1
+                self.logging.error(f"command {argv} failed: {e}")
+                return {"status": "error", "message": str(e)}
+        self.stats["commands"] += 1
+        return {"status": "ok", "elapsed": round(time.perf_counter() - start, 4)}
+
+    async def execute_frame(self, rgb: bytes, size: int, address: Optional[str] = None) -> Dict:
+        """shows a raw RGB frame over the shared connection"""
+        start = time.perf_counter()
+        try:
+            # checked before the link is ensured, a malformed frame never reaches the display
+            check_frame(rgb, size)
+        except ValueError as e:
+            self.stats["failed"] += 1
+            return {"status": "error", "message": str(e)}
+        return await self._execute_upload("frame", self.cmd.frame(rgb, size), address, start)
+
+    async def execute_gif(self, data: bytes, address: Optional[str] = None) -> Dict:
+        """uploads gif bytes over the shared connection"""
+        return await self._execute_upload("gif", self.cmd.gif_data(data), address, time.perf_counter())
+
+    async def _execute_upload(self, name: str, upload, address: Optional[str], start: float) -> Dict:
+        """runs an upload coroutine of CMD with the link to address ensured"""
+        address = address or self.address
+        async with self.lock:
+            try:
+                await self.link.ensure(address)
+                await upload
+                self.address = address or self.address
+            except Exception as e:
+                upload.close()
+                self.stats["failed"] += 1
+                self.logging.error(f"{name} failed: {e}")
+                return {"status": "error", "message": str(e)}
+        self.stats["commands"] += 1
+        return {"status": "ok", "elapsed": round(time.perf_counter() - start, 4)}
+
+    def get_stats(self) -> Dict:
+        """returns command counters of the daemon and the packet cache"""
+        return {
+            **self.stats,
+            "address": self.address,
+            "packet_cache": self.cmd.packets.stats(),
+            "link": self.link.get_stats() if self.link else None,
+        }
+
+    async def _handle_client(self, reader, writer) -> None:
+        """answers every JSON line of a client connection"""
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # the line exceeded the stream limit, the rest of it can't be told apart from the next request
+                    reply = {"status": "error", "message": f"request exceeds {MAX_REQUEST_BYTES} bytes"}
+                    writer.write((json.dumps(reply) + "\n").encode("utf-8"))
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if request.get("stats"):
+                        reply = {"status": "ok", "stats": self.get_stats()}
+                    elif "forget" in request:
+                        # another process drew on these displays, e.g. a group broadcast of the admin panel
+                        for address in request["forget"]:
+                            self.cmd.frames.invalidate(address)
+                        reply = {"status": "ok"}
+                    elif "gif" in request:
+                        reply = await self.execute_gif(base64.b64decode(request["gif"]), request.get("address"))
+                    elif "frame" in request:
+                        reply = await self.execute_frame(
+                            base64.b64decode(request["frame"]), request["size"], request.get("address")
+                        )
+                    else:
+                        reply = await self.execute(request["args"])
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    reply = {"status": "error", "message": "expected {\"args\": [...]}, {\"frame\": ..., \"size\": ...}, {\"gif\": ...}, {\"forget\": [...]} or {\"stats\": true}"}
+                writer.write((json.dumps(reply) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        """connects to the display (if known) and serves commands forever"""
+        self.lock = asyncio.Lock()
+        self.link = LinkKeeper(self.lock, frames=self.cmd.frames)
+        if self.address:
+            try:
+                async with self.lock:
+                    await self.link.ensure(self.address)
+            except Exception as e:
+                # the link keeper keeps retrying in the background
+                self.logging.error(f"could not connect to {self.address}: {e}")
+        self.server = await asyncio.start_server(
+            self._handle_client, self.host, self.port, limit=MAX_REQUEST_BYTES
+        )
+        self.stats["started_at"] = time.time()
+        self.logging.info(f"display daemon listening on {self.host}:{self.port}")
+        self.ready.set()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def start_background(self, timeout: float = 10.0) -> threading.Thread:
+        """runs the daemon in a daemon thread of the current process"""
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(),))
+        thread.daemon = True
+        thread.start()
+        if not self.ready.wait(timeout):
+            self.logging.warning("display daemon did not become ready in time")
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="keeps a connection to a pixel display open and executes app.py commands sent over a local socket"
+    )
+    parser.add_argument(
+        "--address",
+        action="store",
+        help="the bluetooth address of the device to connect to on startup",
+    )
+    parser.add_argument(
+        "--host",
+        action="store",
+        default=DEFAULT_HOST,
+        help=f"interface to listen on. Defaults to {DEFAULT_HOST}",
+    )
+    parser.add_argument(
+        "--port",
+        action="store",
+        type=int,
+        default=DEFAULT_PORT,
+        help=f"port to listen on. Defaults to {DEFAULT_PORT}",
+    )
+    args = parser.parse_args()
+    daemon = DisplayDaemon(address=args.address, host=args.host, port=args.port)
+    asyncio.run(daemon.serve())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s :: %(levelname)s :: %(name)s :: %(message)s",
+        datefmt="%d.%m.%Y %H:%M:%S",
+        handlers=[logging.StreamHandler()],
+    )
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+    logging.getLogger("bleak").setLevel(logging.WARNING)
+    log = logging.getLogger("idotmatrix")
+    try:
+        main()
+    except KeyboardInterrupt:
+        log.info("Caught keyboard interrupt. Stopping display daemon.")
@@ -0,0 +1,98 @@
+# python imports
+import base64
+import json
+import os
+import socket
+from typing import Dict, List, Optional
+
+# the display daemon only listens on the loopback interface
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = int(os.environ.get("IDOTMATRIX_DAEMON_PORT", 8765))
+# longest request line the daemon reads, base64 gif and frame uploads included
+MAX_REQUEST_BYTES = 4 * 1024 * 1024
+
+
+class DaemonError(Exception):
+    """raised when the display daemon is unreachable or a command failed"""
+
+
+def send_command(
+    args: List[str],
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    timeout: Optional[float] = 60.0,
+) -> Dict:
+    """sends app.py style arguments (e.g. ["--screen", "on"]) to the display daemon
+
+    Returns the reply of the daemon. Raises DaemonError if the daemon can not be
+    reached or reports that the command failed.
+    """
+    return _request({"args": [str(arg) for arg in args]}, host, port, timeout)
+
+
+def send_frame(
+    rgb: bytes,
+    size: int,
+    address: Optional[str] = None,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    timeout: Optional[float] = 60.0,
+) -> Dict:
+    """shows a raw RGB frame of size x size pixels without writing an image file first"""
+    payload = {"frame": base64.b64encode(rgb).decode("ascii"), "size": size}
+    if address:
+        payload["address"] = address
+    return _request(payload, host, port, timeout)
+
+
+def send_gif(
+    data: bytes,
+    address: Optional[str] = None,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    timeout: Optional[float] = 60.0,
+) -> Dict:
+    """uploads gif bytes (e.g. an animated emoji) without writing a gif file first"""
+    payload = {"gif": base64.b64encode(data).decode("ascii")}
+    if address:
+        payload["address"] = address
+    return _request(payload, host, port, timeout)
+
+
+def forget_frames(
+    addresses: List[str],
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    timeout: Optional[float] = 5.0,
+) -> Dict:
+    """tells the daemon that something else drew on these displays, so it won't send diffs against its old frame"""
+    return _request({"forget": [str(address) for address in addresses]}, host, port, timeout)
+
+
+def get_stats(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    timeout: Optional[float] = 5.0,
+) -> Dict:
+    """returns the counters of the display daemon (commands, packet cache, ...)"""
+    return _request({"stats": True}, host, port, timeout)["stats"]
+
+
+def _request(payload: Dict, host: str, port: int, timeout: Optional[float]) -> Dict:
+    """sends one JSON line to the daemon and returns its reply"""
+    request = json.dumps(payload) + "\n"
+    if len(request) > MAX_REQUEST_BYTES:
+        raise DaemonError(f"request of {len(request)} bytes exceeds the daemon limit of {MAX_REQUEST_BYTES} bytes")
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.sendall(request.encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as reader:
+                line = reader.readline()
+    except OSError as e:
+        raise DaemonError(f"display daemon not reachable on {host}:{port}: {e}") from e
+    if not line:
+        raise DaemonError("display daemon closed the connection without a reply")
+    reply = json.loads(line)
+    if reply.get("status") != "ok":
+        raise DaemonError(reply.get("message", "command failed"))
+    return reply
@@ -0,0 +1,125 @@
+# python imports
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bleak import BleakScanner
+
+# idotmatrix imports
+from idotmatrix.const import BLUETOOTH_DEVICE_NAME
+
+DEFAULT_CACHE_FILE = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "cache", "discovered_devices.json")
+)
+# a display seen within the last week is trusted without scanning
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+logger = logging.getLogger("idotmatrix." + __name__)
+
+
+class DiscoveryCache:
+    """Persists the addresses of known displays with the time they were last seen."""
+
+    logging = logger
+
+    def __init__(self, cache_file: str = DEFAULT_CACHE_FILE, ttl: float = DEFAULT_TTL) -> None:
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.devices: Dict[str, Dict] = {}
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as file:
+                self.devices = json.load(file)
+        except FileNotFoundError:
+            self.devices = {}
+        except (OSError, ValueError) as e:
+            self.logging.warning(f"ignoring unreadable discovery cache: {e}")
+            self.devices = {}
+
+    def save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(self.cache_file, "w", encoding="utf-8") as file:
+                json.dump(self.devices, file, indent=2)
+        except OSError as e:
+            self.logging.warning(f"could not save discovery cache: {e}")
+
+    def remember(self, address: str, name: Optional[str] = None) -> None:
+        """records that a display was seen (or connected to) just now"""
+        entry = self.devices.setdefault(address.upper(), {})
+        entry["last_seen"] = time.time()
+        if name:
+            entry["name"] = name
+        self.save()
+
+    def forget(self, address: str) -> None:
+        """drops a display which could not be reached, so the next lookup scans again"""
+        if self.devices.pop(address.upper(), None) is not None:
+            self.save()
+
+    def known(self) -> List[str]:
+        """returns all known addresses, most recently seen first"""
+        return sorted(self.devices, key=lambda a: self.devices[a].get("last_seen", 0), reverse=True)
+
+    def fresh(self) -> List[str]:
+        """returns the known addresses seen within the TTL, most recently seen first"""
+        now = time.time()
+        return [a for a in self.known() if now - self.devices[a].get("last_seen", 0) <= self.ttl]
+
+
+async def targeted_scan(
+    known_addresses: Iterable[str] = (),
+    name_prefix: str = BLUETOOTH_DEVICE_NAME,
+    timeout: float = 10.0,
+) -> Optional[Tuple[str, Optional[str]]]:
+    """scans until the first known address or display name prefix shows up
+
+    Returns (address, name) or None if nothing matched within the timeout.
+    """
+    wanted = {address.upper() for address in known_addresses}
+    found: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def detection_callback(device, advertisement_data):
+        if found.done():
+            return
+        name = advertisement_data.local_name or device.name
+        if device.address.upper() in wanted or (name and name.startswith(name_prefix)):
+            found.set_result((device.address, name))
+
+    scanner = BleakScanner(detection_callback=detection_callback)
+    start = time.perf_counter()
+    await scanner.start()
+    try:
+        result = await asyncio.wait_for(found, timeout)
+        logger.info(f"found device {result[0]} with name {result[1]} after {time.perf_counter() - start:.2f}s")
+        return result
+    except asyncio.TimeoutError:
+        logger.warning(f"no display found within {timeout}s")
+        return None
+    finally:
+        await scanner.stop()
+
+
+def find_display(
+    cache: Optional[DiscoveryCache] = None, timeout: float = 10.0, use_cache: bool = True
+) -> Optional[str]:
+    """returns the address of a display, from the cache if still fresh, otherwise by a targeted scan
+
+    use_cache=False always scans, e.g. after connecting to the cached address failed.
+    """
+    cache = cache or DiscoveryCache()
+    fresh = cache.fresh() if use_cache else []
+    if fresh:
+        logger.info(f"using cached display address {fresh[0]}")
+        return fresh[0]
+    result = asyncio.run(targeted_scan(cache.known(), timeout=timeout))
+    if result is None:
+        return None
+    address, name = result
+    cache.remember(address, name)
+    return address
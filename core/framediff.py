@@ -0,0 +1,128 @@
+# python imports
+import functools
+import io
+import logging
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy
+from PIL import Image as PilImage
+
+# idotmatrix imports
+from core.graffiti import build_packets
+
+# every write costs roughly one connection event on top of its bytes, expressed in bytes
+WRITE_OVERHEAD = 24
+# header of every 4096 byte chunk of an image upload
+IMAGE_CHUNK_HEADER_SIZE = 9
+# no png is smaller than its signature, IHDR, IDAT and IEND chunks
+MIN_PNG_SIZE = 57
+
+
+def load_frame(file_path, pixel_size: Optional[int] = None) -> numpy.ndarray:
+    """loads an image (path or file object) the way the display will show it as an (height, width, 3) RGB array"""
+    with PilImage.open(file_path) as img:
+        if pixel_size and img.size != (pixel_size, pixel_size):
+            img = img.resize((pixel_size, pixel_size), PilImage.LANCZOS)
+        return numpy.asarray(img.convert("RGB"), dtype=numpy.uint8)
+
+
+def lazy_frame(source: bytes, pixel_size: Optional[int] = None) -> Callable[[], numpy.ndarray]:
+    """returns a function which decodes the image source on first use only"""
+
+    @functools.lru_cache(maxsize=1)
+    def load() -> numpy.ndarray:
+        return load_frame(io.BytesIO(source), pixel_size)
+
+    return load
+
+
+def changed_pixels(old: numpy.ndarray, new: numpy.ndarray) -> List[Tuple[int, int, int, int, int]]:
+    """returns all pixels (x, y, r, g, b) of new which differ from old"""
+    ys, xs = numpy.nonzero(numpy.any(old != new, axis=2))
+    colors = new[ys, xs]
+    return [
+        (int(x), int(y), int(r), int(g), int(b))
+        for x, y, (r, g, b) in zip(xs, ys, colors)
+    ]
+
+
+def graffiti_cost(pixels, write_size: int) -> int:
+    """estimated cost of sending the pixels as graffiti packets"""
+    packets = build_packets(pixels, write_size)
+    return sum(len(packet) for packet in packets) + WRITE_OVERHEAD * len(packets)
+
+
+def payload_png_size(payload_size: int) -> int:
+    """size of the png inside an image upload payload of the given size"""
+    chunks = -(-payload_size // (4096 + IMAGE_CHUNK_HEADER_SIZE))
+    return payload_size - IMAGE_CHUNK_HEADER_SIZE * chunks
+
+
+def image_cost(png_size: int, write_size: int) -> int:
+    """estimated cost of uploading a png of the given size"""
+    chunks = max(1, -(-png_size // 4096))
+    total = png_size + IMAGE_CHUNK_HEADER_SIZE * chunks
+    writes = -(-total // write_size)
+    return total + WRITE_OVERHEAD * writes
+
+
+class FrameStore:
+    """Per-device model of the frame the display is currently showing."""
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self) -> None:
+        # frames are decoded lazily, so an entry may be a loader until it is needed
+        self.frames: Dict[str, Union[numpy.ndarray, Callable[[], numpy.ndarray]]] = {}
+
+    @staticmethod
+    def _key(address: Optional[str]) -> str:
+        return str(address).upper()
+
+    def get(self, address: Optional[str]) -> Optional[numpy.ndarray]:
+        """returns the last frame sent to the device or None if unknown"""
+        frame = self.frames.get(self._key(address))
+        if callable(frame):
+            frame = frame()
+            self.frames[self._key(address)] = frame
+        return frame
+
+    def set(self, address: Optional[str], frame) -> None:
+        """remembers the frame (or a function loading it) the device shows now"""
+        self.frames[self._key(address)] = frame if callable(frame) else frame.copy()
+
+    def invalidate(self, address: Optional[str]) -> None:
+        """forgets the frame of a device after anything else was drawn on it"""
+        self.frames.pop(self._key(address), None)
+
+    def plan(
+        self,
+        address: Optional[str],
+        frame,
+        png_size: Union[int, Callable[[], int]],
+        write_size: int,
+    ) -> Optional[List[Tuple[int, int, int, int, int]]]:
+        """returns the changed pixels if sending them is cheaper than a full upload, otherwise None
+
+        png_size may be a function encoding the frame, it is only called if the
+        diff is not already cheaper than the smallest possible upload.
+        """
+        previous = self.get(address)
+        if previous is None:
+            return None
+        if callable(frame):
+            frame = frame()
+        if previous.shape != frame.shape:
+            return None
+        pixels = changed_pixels(previous, frame)
+        diff = graffiti_cost(pixels, write_size)
+        if callable(png_size):
+            if diff < image_cost(MIN_PNG_SIZE, write_size):
+                self.logging.debug(f"{len(pixels)} changed pixels: graffiti cost {diff}, no upload is cheaper")
+                return pixels
+            png_size = png_size()
+        full = image_cost(png_size, write_size)
+        self.logging.debug(
+            f"{len(pixels)} changed pixels: graffiti cost {diff}, upload cost {full}"
+        )
+        return pixels if diff < full else None
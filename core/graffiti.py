@@ -0,0 +1,91 @@
+# python imports
+import logging
+import time
+from typing import Dict, Iterable, List, Tuple
+
+# idotmatrix imports
+from idotmatrix import ConnectionManager
+from idotmatrix.const import UUID_WRITE_DATA
+
+# graffiti packet: <len lo> <len hi> 05 01 00 <r> <g> <b> followed by <x> <y> pairs
+GRAFFITI_HEADER_SIZE = 8
+# ATT MTU of 23 bytes minus 3 bytes ATT header, guaranteed by every BLE link
+DEFAULT_WRITE_SIZE = 20
+
+Pixel = Tuple[int, int, int, int, int]
+
+
+def build_packets(pixels: Iterable[Pixel], write_size: int) -> List[bytearray]:
+    """packs pixels (x, y, r, g, b) into graffiti packets of at most write_size bytes
+
+    Pixels sharing a color are sent as one packet with several x/y pairs.
+    If a pixel is given more than once the last color wins.
+    """
+    per_packet = max(1, (write_size - GRAFFITI_HEADER_SIZE) // 2)
+    latest: Dict[Tuple[int, int], Tuple[int, int, int]] = {}
+    for x, y, r, g, b in pixels:
+        latest[(x, y)] = (r, g, b)
+    by_color: Dict[Tuple[int, int, int], List[Tuple[int, int]]] = {}
+    for position, color in latest.items():
+        by_color.setdefault(color, []).append(position)
+    packets = []
+    for (r, g, b), positions in by_color.items():
+        for i in range(0, len(positions), per_packet):
+            chunk = positions[i : i + per_packet]
+            length = GRAFFITI_HEADER_SIZE + 2 * len(chunk)
+            packet = bytearray(length.to_bytes(2, byteorder="little"))
+            packet.extend([5, 1, 0, r, g, b])
+            for x, y in chunk:
+                packet.extend([x, y])
+            packets.append(packet)
+    return packets
+
+
+class BatchedGraffiti:
+    """Graffiti mode which uses the MTU of the connection instead of one write per pixel."""
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self) -> None:
+        self.conn: ConnectionManager = ConnectionManager()
+
+    async def write_size(self) -> int:
+        """returns the biggest write the current connection accepts"""
+        client = self.conn.client
+        if not client or not client.is_connected:
+            return DEFAULT_WRITE_SIZE
+        # same source as ConnectionManager.send, the ATT MTU minus its header if the backend doesn't report it
+        try:
+            characteristic = client.services.get_characteristic(UUID_WRITE_DATA)
+            return max(DEFAULT_WRITE_SIZE, characteristic.max_write_without_response_size)
+        except Exception:
+            pass
+        try:
+            return max(DEFAULT_WRITE_SIZE, client.mtu_size - 3)
+        except Exception:
+            return DEFAULT_WRITE_SIZE
+
+    async def setPixels(self, pixels: Iterable[Pixel]) -> Dict:
+        """sets all given pixels (x, y, r, g, b) using as few writes as possible"""
+        await self.conn.connect()
+        write_size = await self.write_size()
+        packets = build_packets(pixels, write_size)
+        pixel_count = sum((len(packet) - GRAFFITI_HEADER_SIZE) // 2 for packet in packets)
+        start = time.perf_counter()
+        for i, packet in enumerate(packets):
+            # the last write is acknowledged so no pixel gets lost in the device buffer
+            await self.conn.client.write_gatt_char(
+                UUID_WRITE_DATA, packet, response=(i == len(packets) - 1)
+            )
+        elapsed = time.perf_counter() - start
+        rate = pixel_count / elapsed if elapsed > 0 else float(pixel_count)
+        self.logging.debug(
+            f"sent {pixel_count} pixels in {len(packets)} writes of max. {write_size} bytes ({rate:.0f} pixels/s)"
+        )
+        return {
+            "pixels": pixel_count,
+            "writes": len(packets),
+            "write_size": write_size,
+            "seconds": elapsed,
+            "pixels_per_second": rate,
+        }
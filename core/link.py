@@ -0,0 +1,229 @@
+# python imports
+import asyncio
+from datetime import datetime
+import logging
+import time
+from typing import Dict, Optional
+
+from bleak import BleakClient
+
+# idotmatrix imports
+from idotmatrix import ConnectionManager
+from idotmatrix.const import UUID_READ_DATA, UUID_WRITE_DATA
+from core.framediff import FrameStore
+
+
+class TrackedClient(BleakClient):
+    """BleakClient which reports every write, used to measure time-to-first-write"""
+
+    on_write = None
+
+    async def write_gatt_char(self, *args, **kwargs):
+        if self.on_write:
+            self.on_write()
+        return await super().write_gatt_char(*args, **kwargs)
+
+
+class LinkKeeper:
+    """Keeps the connection of ConnectionManager warm.
+
+    Drops are detected through the disconnect callback of bleak and by a cheap
+    read on idle links. Displays whose read characteristic only notifies get
+    an acknowledged write of the current time instead, which they show anyway. Reconnects happen in the background with exponential
+    backoff, so a command usually finds an open connection. The display may
+    have lost its frame across a drop, so the frame model is forgotten then.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(
+        self,
+        lock: asyncio.Lock,
+        keepalive_interval: float = 15.0,
+        backoff_min: float = 0.5,
+        backoff_max: float = 30.0,
+        frames: Optional[FrameStore] = None,
+    ) -> None:
+        self.conn: ConnectionManager = ConnectionManager()
+        self.lock = lock
+        self.keepalive_interval = keepalive_interval
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.frames = frames
+        self.address: Optional[str] = None
+        self.dropped = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.connected_at: Optional[float] = None
+        self.last_activity = time.monotonic()
+        self.command_started: Optional[float] = None
+        self.stats = {
+            "connected_seconds": 0.0,
+            "connects": 0,
+            "reconnects": 0,
+            "drops": 0,
+            "keepalives": 0,
+            "time_to_first_write": None,
+            "time_to_first_write_avg": None,
+        }
+        self._first_writes = 0
+        self._keepalive_logged = False
+
+    def _on_disconnect(self, client: BleakClient) -> None:
+        """called by bleak as soon as the link is lost"""
+        if client is not self.conn.client:
+            return
+        if self.connected_at is not None:
+            self.stats["connected_seconds"] += time.monotonic() - self.connected_at
+            self.connected_at = None
+        self.stats["drops"] += 1
+        self.logging.warning(f"connection to {self.address} dropped")
+        self._forget_frame()
+        self.dropped.set()
+
+    def _forget_frame(self) -> None:
+        """the next image goes up in full instead of as a diff against a frame the display may have lost"""
+        if self.frames is not None:
+            self.frames.invalidate(self.address)
+
+    def _on_write(self) -> None:
+        """records how long the running command waited for its first write"""
+        self.last_activity = time.monotonic()
+        if self.command_started is None:
+            return
+        elapsed = self.last_activity - self.command_started
+        self.command_started = None
+        self._first_writes += 1
+        previous = self.stats["time_to_first_write_avg"] or 0.0
+        self.stats["time_to_first_write"] = round(elapsed, 4)
+        self.stats["time_to_first_write_avg"] = round(
+            previous + (elapsed - previous) / self._first_writes, 4
+        )
+
+    def is_connected(self) -> bool:
+        client = self.conn.client
+        return bool(client and client.is_connected)
+
+    async def _connect(self) -> None:
+        """(re)connects ConnectionManager using a tracked client"""
+        client = self.conn.client
+        if not isinstance(client, TrackedClient) or client.address.upper() != self.address.upper():
+            # detach the old client first so its disconnect is not counted as a drop
+            self.conn.client = None
+            if client and client.is_connected:
+                await client.disconnect()
+            client = TrackedClient(self.address, disconnected_callback=self._on_disconnect)
+            client.on_write = self._on_write
+            self.conn.client = client
+        self.conn.address = self.address
+        if not client.is_connected:
+            await client.connect()
+            self.connected_at = time.monotonic()
+            self.last_activity = self.connected_at
+            self.stats["connects"] += 1
+            self.dropped.clear()
+            self.logging.info(f"connected to {self.address}")
+
+    async def ensure(self, address: Optional[str]) -> None:
+        """makes sure the link to address is open before a command runs (call with lock held)"""
+        self.command_started = time.monotonic()
+        if address and address.lower() == "auto":
+            # CMD.run searches for the device itself
+            return
+        if address and (self.address is None or address.upper() != self.address.upper()):
+            self.logging.info(f"switching display from {self.address} to {address}")
+            self.address = address
+        self.start()
+        if self.address and not self.is_connected():
+            try:
+                await self._connect()
+            except Exception:
+                # let the background task retry with backoff right away
+                self.dropped.set()
+                raise
+
+    def start(self) -> None:
+        """starts the background keepalive / reconnect task"""
+        if self.address and (self.task is None or self.task.done()):
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def _readable(self) -> bool:
+        """whether the notify characteristic of the display also allows reads"""
+        try:
+            characteristic = self.conn.client.services.get_characteristic(UUID_READ_DATA)
+        except Exception:
+            return False
+        return characteristic is not None and "read" in characteristic.properties
+
+    @staticmethod
+    def _time_packet() -> bytes:
+        """the set time command of Common.setTime with the current local time"""
+        now = datetime.now()
+        return bytes([11, 0, 1, 128, now.year % 100, now.month, now.day, now.weekday() + 1,
+                      now.hour, now.minute, now.second])
+
+    async def _keepalive(self) -> None:
+        """cheap read (or time sync) on an idle link, a failing one counts as a drop"""
+        readable = self._readable()
+        if not self._keepalive_logged:
+            self._keepalive_logged = True
+            self.logging.info(
+                f"keepalive of {self.address}: {'reads' if readable else 'time syncs, the display is notify only'}"
+            )
+        try:
+            if readable:
+                await self.conn.client.read_gatt_char(UUID_READ_DATA)
+            else:
+                # not a command, it must not be measured as the first write of one
+                self.command_started = None
+                await self.conn.client.write_gatt_char(UUID_WRITE_DATA, self._time_packet(), response=True)
+            self.stats["keepalives"] += 1
+            self.last_activity = time.monotonic()
+        except Exception as e:
+            self.logging.warning(f"keepalive failed: {e}")
+            try:
+                await self.conn.client.disconnect()
+            except Exception:
+                pass
+            self._forget_frame()
+            self.dropped.set()
+
+    async def _reconnect(self) -> None:
+        """reconnects with exponential backoff until the link is back"""
+        delay = self.backoff_min
+        while True:
+            async with self.lock:
+                if self.is_connected():
+                    return
+                try:
+                    await self._connect()
+                    self.stats["reconnects"] += 1
+                    return
+                except Exception as e:
+                    self.logging.warning(f"reconnect to {self.address} failed, retrying in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(self.backoff_max, delay * 2)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.dropped.wait(), timeout=self.keepalive_interval)
+            except asyncio.TimeoutError:
+                pass
+            if not self.is_connected():
+                await self._reconnect()
+                continue
+            if time.monotonic() - self.last_activity >= self.keepalive_interval and not self.lock.locked():
+                async with self.lock:
+                    if self.is_connected():
+                        await self._keepalive()
+
+    def get_stats(self) -> Dict:
+        """returns uptime, reconnect counts and time-to-first-write of the link"""
+        uptime = time.monotonic() - self.connected_at if self.connected_at is not None else 0.0
+        return {
+            **self.stats,
+            "address": self.address,
+            "connected": self.is_connected(),
+            "uptime_seconds": round(uptime, 1),
+            "connected_seconds": round(self.stats["connected_seconds"] + uptime, 1),
+        }
@@ -0,0 +1,247 @@
+# python imports
+import hashlib
+import io
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image as PilImage
+
+# idotmatrix imports
+from idotmatrix import Gif, Image
+
+DEFAULT_CACHE_DIR = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "cache", "packets")
+)
+# entries on disk beyond this size are deleted, least recently used first
+DEFAULT_MAX_DISK_BYTES = 64 * 1024 * 1024
+
+
+def encode_image(source: bytes, pixel_size: Optional[int] = None) -> List[bytes]:
+    """builds the upload payload of an image like Image.uploadUnprocessed / uploadProcessed"""
+    # mirrors Image.uploadProcessed of idotmatrix 0.0.9 (the version pinned in pyproject.toml)
+    png_data = source
+    if pixel_size:
+        with PilImage.open(io.BytesIO(source)) as img:
+            if img.size != (pixel_size, pixel_size):
+                img = img.resize((pixel_size, pixel_size), PilImage.LANCZOS)
+            png_buffer = io.BytesIO()
+            img.save(png_buffer, format="PNG")
+            png_data = png_buffer.getvalue()
+    return [bytes(Image()._createPayloads(png_data))]
+
+
+def encode_frame(source: bytes, pixel_size: Optional[int] = None) -> List[bytes]:
+    """builds the upload payload of a raw RGB frame of pixel_size x pixel_size pixels"""
+    img = PilImage.frombytes("RGB", (pixel_size, pixel_size), source)
+    png_buffer = io.BytesIO()
+    img.save(png_buffer, format="PNG")
+    return [bytes(Image()._createPayloads(png_buffer.getvalue()))]
+
+
+def encode_gif(source: bytes, pixel_size: Optional[int] = None) -> List[bytes]:
+    """builds the upload chunks of a gif like Gif.uploadUnprocessed / uploadProcessed"""
+    # copy of the frame handling of Gif.uploadProcessed in idotmatrix 0.0.9 (the version pinned in
+    # pyproject.toml), check it again when upgrading the library
+    gif_data = source
+    if pixel_size:
+        with PilImage.open(io.BytesIO(source)) as img:
+            frames = []
+            try:
+                while True:
+                    frame = img.copy()
+                    if frame.size != (pixel_size, pixel_size):
+                        frame = frame.resize((pixel_size, pixel_size), PilImage.NEAREST)
+                    frames.append(frame.copy())
+                    img.seek(img.tell() + 1)
+            except EOFError:
+                pass
+            gif_buffer = io.BytesIO()
+            frames[0].save(
+                gif_buffer,
+                format="GIF",
+                save_all=True,
+                append_images=frames[1:],
+                loop=1,
+                duration=img.info["duration"],
+                disposal=2,
+            )
+            gif_data = gif_buffer.getvalue()
+    return [bytes(chunk) for chunk in Gif()._createPayloads(gif_data)]
+
+
+class PacketCache:
+    """Content-addressed cache of ready to send upload packets.
+
+    Entries are keyed by the hash of the source file, the pixel size and the
+    upload mode. They are kept in memory with LRU eviction and persisted on
+    disk, so repeated uploads skip decoding, resizing and packet building.
+    The disk entries are capped at max_disk_bytes, pruned by last use.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_entries: int = 256,
+        max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        # size of the entries on disk, measured on the first write
+        self.disk_bytes: Optional[int] = None
+        self.entries: "OrderedDict[str, List[bytes]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0}
+
+    @staticmethod
+    def key(source: bytes, pixel_size: Optional[int], mode: str) -> str:
+        """returns the cache key of a source file for a pixel size and mode"""
+        digest = hashlib.sha256(source).hexdigest()
+        return f"{digest}-{pixel_size or 'raw'}-{mode}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _read(self, key: str) -> Optional[List[bytes]]:
+        """reads an entry from disk: <count> followed by <length><chunk> for every chunk"""
+        try:
+            with open(self._path(key), "rb") as file:
+                data = file.read()
+            # the modification time doubles as last use for pruning
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            return None
+        try:
+            (count,) = struct.unpack_from("<I", data, 0)
+            offset = 4
+            chunks = []
+            for _ in range(count):
+                (length,) = struct.unpack_from("<I", data, offset)
+                offset += 4
+                chunks.append(data[offset : offset + length])
+                offset += length
+            return chunks
+        except struct.error:
+            self.logging.warning(f"ignoring corrupt packet cache entry {key}")
+            return None
+
+    def _write(self, key: str, chunks: List[bytes]) -> None:
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            buffer = bytearray(struct.pack("<I", len(chunks)))
+            for chunk in chunks:
+                buffer.extend(struct.pack("<I", len(chunk)))
+                buffer.extend(chunk)
+            # write to a temporary file first so readers never see a partial entry
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(buffer)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            self.logging.warning(f"could not persist packet cache entry {key}: {e}")
+            return
+        with self.lock:
+            if self.disk_bytes is None:
+                self.disk_bytes = 0
+                self._prune_disk()
+            else:
+                self.disk_bytes += len(buffer)
+                if self.disk_bytes > self.max_disk_bytes:
+                    self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        """deletes the least recently used entries until the disk entries fit max_disk_bytes (call with lock held)"""
+        try:
+            entries = []
+            with os.scandir(self.cache_dir) as scan:
+                for entry in scan:
+                    if entry.name.endswith(".bin"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            self.logging.warning(f"could not list the packet cache: {e}")
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                self.counters["disk_evictions"] += 1
+            except OSError:
+                pass
+            total -= size
+        self.disk_bytes = total
+
+    def _remember(self, key: str, chunks: List[bytes]) -> None:
+        self.entries[key] = chunks
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get(self, key: str) -> Optional[List[bytes]]:
+        """returns the cached chunks of a key from memory or disk"""
+        with self.lock:
+            chunks = self.entries.get(key)
+            if chunks is not None:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return chunks
+            chunks = self._read(key)
+            if chunks is not None:
+                self._remember(key, chunks)
+                self.counters["disk_hits"] += 1
+                return chunks
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key: str, chunks: List[bytes]) -> None:
+        """stores chunks in memory and on disk"""
+        with self.lock:
+            self._remember(key, chunks)
+        self._write(key, chunks)
+
+    def get_or_build(
+        self,
+        source: bytes,
+        pixel_size: Optional[int],
+        mode: str,
+        build: Callable[[bytes, Optional[int]], List[bytes]],
+    ) -> List[bytes]:
+        """returns the cached chunks or builds and caches them"""
+        key = self.key(source, pixel_size, mode)
+        chunks = self.get(key)
+        if chunks is None:
+            chunks = build(source, pixel_size)
+            self.put(key, chunks)
+        return chunks
+
+    def image(self, source: bytes, pixel_size: Optional[int] = None) -> List[bytes]:
+        """returns the upload payload of an image"""
+        return self.get_or_build(source, pixel_size, "image", encode_image)
+
+    def frame(self, source: bytes, pixel_size: int) -> List[bytes]:
+        """returns the upload payload of a raw RGB frame"""
+        return self.get_or_build(source, pixel_size, "frame", encode_frame)
+
+    def gif(self, source: bytes, pixel_size: Optional[int] = None) -> List[bytes]:
+        """returns the upload chunks of a gif"""
+        return self.get_or_build(source, pixel_size, "gif", encode_gif)
+
+    def stats(self) -> Dict:
+        """returns hit/miss counters and the number of entries in memory"""
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "entries": len(self.entries),
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
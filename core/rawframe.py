@@ -0,0 +1,39 @@
+# python imports
+import struct
+from typing import Tuple
+
+# raw frame files: magic, width, height, then width * height RGB888 pixels row by row
+MAGIC = b"RGB8"
+HEADER = struct.Struct("<4sHH")
+# the largest displays are 64x64
+MAX_FRAME_SIZE = 64
+
+
+def pack_frame(rgb: bytes, width: int, height: int) -> bytes:
+    """prefixes RGB888 pixels with the raw frame header"""
+    if len(rgb) != width * height * 3:
+        raise ValueError(f"{len(rgb)} bytes are not a {width}x{height} RGB frame")
+    return HEADER.pack(MAGIC, width, height) + bytes(rgb)
+
+
+def check_frame(rgb: bytes, size: int) -> None:
+    """raises ValueError unless rgb holds exactly size x size RGB888 pixels of a supported size"""
+    if not isinstance(size, int) or isinstance(size, bool) or not 1 <= size <= MAX_FRAME_SIZE:
+        raise ValueError(f"frame size must be an integer from 1 to {MAX_FRAME_SIZE}, got {size!r}")
+    if len(rgb) != size * size * 3:
+        raise ValueError(f"frame of {len(rgb)} bytes is not {size}x{size} RGB")
+
+
+def is_raw_frame(data: bytes) -> bool:
+    return len(data) >= HEADER.size and bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def unpack_frame(data: bytes) -> Tuple[memoryview, int, int]:
+    """returns the pixels (without copying them), width and height of a raw frame"""
+    if not is_raw_frame(data):
+        raise ValueError("not a raw RGB frame")
+    _, width, height = HEADER.unpack_from(data, 0)
+    rgb = memoryview(data)[HEADER.size:]
+    if len(rgb) != width * height * 3:
+        raise ValueError(f"raw frame of {len(rgb)} bytes is not {width}x{height} RGB")
+    return rgb, width, height
@@ -0,0 +1,118 @@
+# python imports
+import asyncio
+import functools
+import io
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy
+from PIL import Image as PilImage
+from PIL import ImageSequence
+
+# idotmatrix imports
+from idotmatrix import ConnectionManager, Image
+from core.framediff import FrameStore
+from core.graffiti import BatchedGraffiti
+
+Frame = Union[numpy.ndarray, PilImage.Image]
+
+
+def read_frames(paths: List[str]) -> Iterator[PilImage.Image]:
+    """yields the images of the given files in order, every frame of an animated file on its own"""
+    for path in paths:
+        with PilImage.open(path) as img:
+            for frame in ImageSequence.Iterator(img):
+                yield frame.convert("RGB")
+
+
+class FrameStreamer:
+    """Drives a display with a continuous stream of frames.
+
+    Every frame is sent either as graffiti pixels of its diff to the previous
+    frame or as a full image upload, whichever is cheaper. Frames are paced to
+    the target fps; if sending falls behind, late frames are dropped instead
+    of queueing up. A frame is only PNG encoded if the diff could lose.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(
+        self,
+        fps: float = 10.0,
+        pixel_size: Optional[int] = None,
+        frames: Optional[FrameStore] = None,
+    ) -> None:
+        if fps <= 0:
+            raise ValueError(f"fps must be positive, got {fps}")
+        self.conn: ConnectionManager = ConnectionManager()
+        self.fps = fps
+        self.pixel_size = pixel_size
+        # CMD passes its model of the display so image uploads and streams agree
+        self.frames = frames if frames is not None else FrameStore()
+        self.graffiti = BatchedGraffiti()
+        self.stats = {"sent": 0, "dropped": 0, "full": 0, "diff": 0, "encoded": 0}
+
+    def _to_array(self, frame: Frame) -> numpy.ndarray:
+        """converts a PIL image or array to an (height, width, 3) uint8 array of the display size"""
+        if isinstance(frame, numpy.ndarray):
+            if self.pixel_size is None or frame.shape[:2] == (self.pixel_size, self.pixel_size):
+                return numpy.ascontiguousarray(frame[:, :, :3], dtype=numpy.uint8)
+            frame = PilImage.fromarray(frame[:, :, :3].astype(numpy.uint8))
+        if self.pixel_size and frame.size != (self.pixel_size, self.pixel_size):
+            frame = frame.resize((self.pixel_size, self.pixel_size), PilImage.LANCZOS)
+        return numpy.asarray(frame.convert("RGB"), dtype=numpy.uint8)
+
+    async def send_frame(self, frame: Frame, write_size: int) -> None:
+        """sends a single frame using the cheaper of a diff or a full upload"""
+        array = self._to_array(frame)
+
+        @functools.lru_cache(maxsize=1)
+        def encode() -> bytes:
+            png_buffer = io.BytesIO()
+            PilImage.fromarray(array).save(png_buffer, format="PNG", compress_level=1)
+            self.stats["encoded"] += 1
+            return png_buffer.getvalue()
+
+        try:
+            pixels = self.frames.plan(self.conn.address, array, lambda: len(encode()), write_size)
+            if pixels is None:
+                if not await self.conn.send(data=Image()._createPayloads(encode())):
+                    raise ConnectionError("the display is not connected")
+                self.stats["full"] += 1
+            else:
+                if pixels:
+                    await self.graffiti.setPixels(pixels)
+                self.stats["diff"] += 1
+        except Exception:
+            # whatever was drawn partially, the display no longer shows the modelled frame
+            self.frames.invalidate(self.conn.address)
+            raise
+        self.frames.set(self.conn.address, array)
+        self.stats["sent"] += 1
+
+    async def stream(self, frames: Iterable[Frame]) -> Dict:
+        """streams frames at the target fps, dropping frames which are already late"""
+        await self.conn.connect()
+        await Image().setMode(1)
+        write_size = await self.graffiti.write_size()
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.fps
+        start = loop.time()
+        for index, frame in enumerate(frames):
+            due = start + index * period
+            now = loop.time()
+            if now > due + period:
+                # the link could not keep up, skip this frame instead of building a backlog
+                self.stats["dropped"] += 1
+                continue
+            if now < due:
+                await asyncio.sleep(due - now)
+            await self.send_frame(frame, write_size)
+        elapsed = loop.time() - start
+        achieved = self.stats["sent"] / elapsed if elapsed > 0 else 0.0
+        self.logging.info(
+            f"streamed {self.stats['sent']} frames ({self.stats['diff']} diffs, {self.stats['full']} full, "
+            f"{self.stats['encoded']} encoded), "
+            f"dropped {self.stats['dropped']}, {achieved:.1f} of {self.fps} fps"
+        )
+        return {**self.stats, "seconds": elapsed, "fps": achieved}
@@ -0,0 +1,126 @@
+# python imports
+import asyncio
+import logging
+import time
+from typing import Dict, List
+
+# idotmatrix imports
+from idotmatrix import ConnectionManager
+from idotmatrix.const import UUID_READ_DATA, UUID_WRITE_DATA
+
+
+class UploadEngine:
+    """Streams upload chunks (e.g. of a GIF) with write-without-response.
+
+    Up to `window` chunks are sent ahead of the device, every notification on
+    the read characteristic acknowledges one chunk. If notifications are not
+    available, an acknowledgement (also of the last chunks) times out or a
+    write fails, the upload is restarted from the first chunk with acknowledged writes like
+    Gif.uploadUnprocessed, and later uploads over the same connection use
+    acknowledged writes right away.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+    # client of every address whose device did not acknowledge pipelined chunks
+    acknowledged_only: Dict[str, object] = {}
+
+    def __init__(self, window: int = 4, ack_timeout: float = 2.0) -> None:
+        self.conn: ConnectionManager = ConnectionManager()
+        self.window = window
+        self.ack_timeout = ack_timeout
+
+    async def _write_chunk(self, client, chunk: bytes, write_size: int, response: bool) -> None:
+        for i in range(0, len(chunk), write_size):
+            await client.write_gatt_char(UUID_WRITE_DATA, chunk[i : i + write_size], response=response)
+
+    @staticmethod
+    def _can_notify(client) -> bool:
+        """whether the read characteristic can acknowledge chunks at all"""
+        characteristic = client.services.get_characteristic(UUID_READ_DATA)
+        if characteristic is None:
+            return False
+        return "notify" in characteristic.properties or "indicate" in characteristic.properties
+
+    def _fallback_is_sticky(self, client) -> bool:
+        """whether this connection already showed that pipelining doesn't work"""
+        return self.acknowledged_only.get(str(client.address).upper()) is client
+
+    def _stick_to_fallback(self, client) -> None:
+        # remembered for the connection, a new client (e.g. another device on the address) tries pipelining again
+        self.acknowledged_only[str(client.address).upper()] = client
+
+    async def _pipeline(self, client, chunks: List[bytes], write_size: int) -> int:
+        """sends all chunks flow controlled by notifications, returns the number acknowledged or raises"""
+        acks = asyncio.BoundedSemaphore(self.window)
+        in_flight = [0]
+
+        def on_notify(_, data) -> None:
+            # duplicate or stray notifications must not widen the window
+            if in_flight[0] > 0:
+                in_flight[0] -= 1
+                acks.release()
+
+        await client.start_notify(UUID_READ_DATA, on_notify)
+        try:
+            for chunk in chunks:
+                await asyncio.wait_for(acks.acquire(), self.ack_timeout)
+                in_flight[0] += 1
+                await self._write_chunk(client, chunk, write_size, response=False)
+            # wait until the device acknowledged everything still in flight
+            for _ in range(self.window):
+                try:
+                    await asyncio.wait_for(acks.acquire(), self.ack_timeout)
+                except asyncio.TimeoutError:
+                    # the device may have dropped the last chunks, the upload is incomplete
+                    self.logging.debug(f"missing acknowledgement for the last {in_flight[0]} chunks")
+                    return len(chunks) - in_flight[0]
+        finally:
+            try:
+                await client.stop_notify(UUID_READ_DATA)
+            except Exception:
+                pass
+        return len(chunks)
+
+    async def upload(self, chunks: List[bytes]) -> Dict:
+        """uploads all chunks and returns throughput statistics"""
+        await self.conn.connect()
+        client = self.conn.client
+        write_size = client.services.get_characteristic(UUID_WRITE_DATA).max_write_without_response_size
+        total = sum(len(chunk) for chunk in chunks)
+        start = time.perf_counter()
+        sent_pipelined = 0
+        restarted = False
+        if self.window > 0 and not self._fallback_is_sticky(client):
+            if not self._can_notify(client):
+                self.logging.info("the device can't acknowledge chunks, using acknowledged writes")
+                self._stick_to_fallback(client)
+            else:
+                try:
+                    sent_pipelined = await self._pipeline(client, chunks, write_size)
+                    if sent_pipelined < len(chunks):
+                        raise asyncio.TimeoutError(f"{len(chunks) - sent_pipelined} chunks were not acknowledged")
+                except Exception as e:
+                    self.logging.warning(
+                        f"pipelined upload failed, restarting it with acknowledged writes: {str(e) or type(e).__name__}"
+                    )
+                    self._stick_to_fallback(client)
+                    restarted = True
+        if sent_pipelined < len(chunks):
+            # from the first chunk, resuming mid upload could repeat a chunk the device already took
+            sent_pipelined = 0
+            for chunk in chunks:
+                await self._write_chunk(client, chunk, write_size, response=True)
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed > 0 else float(total)
+        self.logging.info(
+            f"uploaded {total} bytes in {len(chunks)} chunks ({sent_pipelined} pipelined"
+            f"{', restarted' if restarted else ''}) in {elapsed:.2f}s ({rate:.0f} bytes/s)"
+        )
+        return {
+            "bytes": total,
+            "chunks": len(chunks),
+            "pipelined_chunks": sent_pipelined,
+            "restarted": restarted,
+            "seconds": elapsed,
+            "bytes_per_second": rate,
+        }
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+DEFAULT_PACK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "emoji.pack")
+
+# Header: magic, version, offset and length of the JSON index at the end of the file
+PACK_MAGIC = b"EMJP"
+PACK_VERSION = 1
+HEADER = struct.Struct("<4sHxxQQ")
+
+
+def _generations(path):
+    # The pack and the newer generations written next to it while it couldn't be replaced
+    directory = os.path.dirname(os.path.abspath(path))
+    prefix = os.path.basename(path) + "."
+    try:
+        filenames = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    paths = [os.path.join(directory, filename) for filename in filenames
+             if filename.startswith(prefix) and filename[len(prefix):].isdigit()]
+    if os.path.exists(path):
+        paths.append(path)
+    return paths
+
+
+def current_pack_path(path=DEFAULT_PACK_FILE):
+    """The newest generation of the pack at path, path itself if there is none"""
+    newest, newest_mtime = path, None
+    for candidate in _generations(path):
+        try:
+            mtime = os.stat(candidate).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if newest_mtime is None or mtime > newest_mtime:
+            newest, newest_mtime = candidate, mtime
+    return newest
+
+
+class EmojiPack:
+    """
+    Read only view of an emoji pack, a single file with raw RGB frames of every emoji at every display size.
+    The file is memory mapped once, frame() returns a zero copy memoryview of a frame with one dict lookup.
+
+    Layout: header | RGB888 frames, row by row | JSON index {"names": {name: {size: offset}}}
+    Names with identical frames point at the same bytes.
+    The newest generation of the pack is opened (see write_pack).
+    """
+
+    def __init__(self, path=DEFAULT_PACK_FILE):
+        self.path = path
+        self.file = path
+        self.index = {}
+        self.view = None
+        self.stat = None
+        self._map = None
+        self.load()
+
+    def load(self):
+        """(Re)opens the pack, an empty pack is used if the file doesn't exist"""
+        self.index = {}
+        self.view = None
+        self._map = None
+        self.file = current_pack_path(self.path)
+        try:
+            stat = os.stat(self.file)
+            with open(self.file, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: empty file which can't be mapped
+            self.stat = None
+            return
+        magic, version, index_offset, index_length = HEADER.unpack_from(mapped, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            mapped.close()
+            raise ValueError(f"{self.file} is not an emoji pack of version {PACK_VERSION}")
+        self.index = json.loads(mapped[index_offset:index_offset + index_length])['names']
+        # Old views stay valid for their holders, the old map is freed once they are gone
+        self._map = mapped
+        self.view = memoryview(mapped)
+        self.stat = (stat.st_size, stat.st_mtime_ns)
+
+    def changed(self):
+        """True if the file was rebuilt or appended to since it was loaded"""
+        path = current_pack_path(self.path)
+        if path != self.file:
+            return True
+        try:
+            stat = os.stat(path)
+            return (stat.st_size, stat.st_mtime_ns) != self.stat
+        except FileNotFoundError:
+            return self.stat is not None
+
+    def close(self):
+        """Unmaps the pack, frames returned before must not be in use anymore"""
+        if self.view is not None:
+            self.view.release()
+        if self._map is not None:
+            self._map.close()
+        self.index = {}
+        self.view = None
+        self._map = None
+
+    def frame(self, name, size):
+        """RGB888 bytes of name at size x size pixels as a memoryview into the pack, or None"""
+        offsets = self.index.get(name)
+        if offsets is None:
+            return None
+        offset = offsets.get(str(size))
+        if offset is None:
+            return None
+        return self.view[offset:offset + size * size * 3]
+
+    def frames(self, name):
+        """All sizes of name as {size: memoryview}"""
+        return {int(size): self.frame(name, int(size)) for size in self.index.get(name, {})}
+
+    def names(self):
+        return list(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+
+def write_pack(entries, path=DEFAULT_PACK_FILE, append=True):
+    """
+    Writes frames into a pack, entries is an iterable of (name, {size: RGB888 bytes}).
+    With append the frames are added to an existing pack and replace names already in it,
+    identical frames are only stored once. Returns the number of names written.
+
+    The pack is written to a temporary file which replaces the old one, readers keep their map
+    of the old file until they load() again, so their offsets never point into a rewritten file.
+    Windows refuses to replace a file another process has mapped, the new pack is then kept as the
+    next generation <path>.<time> which readers open instead. Older generations are removed once unused.
+    """
+    names = {}
+    frame_offsets = {}
+    existing = None
+    data_end = HEADER.size
+    source = current_pack_path(path)
+    if append and os.path.exists(source) and os.path.getsize(source) >= HEADER.size:
+        existing = EmojiPack(path)
+        names = {name: dict(offsets) for name, offsets in existing.index.items()}
+        data_end = HEADER.unpack_from(existing.view, 0)[2]
+        # Known frames by content so appended duplicates point at them
+        for name, offsets in names.items():
+            for size, offset in offsets.items():
+                length = int(size) ** 2 * 3
+                frame_offsets[hashlib.sha256(existing.view[offset:offset + length]).digest()] = offset
+
+    written = 0
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            # Header placeholder and the frames of the old pack, new frames follow them
+            f.write(bytes(HEADER.size))
+            if existing is not None:
+                f.write(existing.view[HEADER.size:data_end])
+                existing.close()
+            for name, frames in entries:
+                offsets = {}
+                for size, rgb in frames.items():
+                    if len(rgb) != size * size * 3:
+                        raise ValueError(f"frame {name} at {size}x{size} has {len(rgb)} bytes")
+                    digest = hashlib.sha256(rgb).digest()
+                    if digest not in frame_offsets:
+                        frame_offsets[digest] = data_end
+                        f.write(rgb)
+                        data_end += len(rgb)
+                    offsets[str(size)] = frame_offsets[digest]
+                names[name] = offsets
+                written += 1
+            index = json.dumps({'names': names}, separators=(',', ':'), sort_keys=True).encode('utf-8')
+            f.write(index)
+            f.seek(0)
+            f.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, data_end, len(index)))
+        target = path
+        try:
+            os.replace(tmp_path, target)
+        except PermissionError:
+            # The pack is mapped by a reader on Windows
+            target = f"{path}.{time.time_ns()}"
+            os.replace(tmp_path, target)
+    except BaseException:
+        if existing is not None:
+            existing.close()
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    for old in _generations(path):
+        if old != target:
+            try:
+                os.remove(old)
+            except OSError:
+                # Still mapped by a reader, removed by a later write
+                pass
+    return written
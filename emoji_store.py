@@ -0,0 +1,240 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import Zhuanhuan
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "emoji_store")
+
+
+class EmojiStore:
+    """
+    Content addressed store of processed emojis.
+    Processed frames are kept once per source hash and processing parameters, emoji names are pointers to them.
+    Aliases and repeated downloads of the same image share one artifact (and so one encoded packet set).
+    Frames are PIL images, animated emojis are GIF bytes per display size.
+
+    Layout: objects/<key>/<size>.png (or .gif) for every display size and one pointer file per name under
+    names/ holding the name and its key. Every pointer is written on its own, so stores in other processes
+    (the Slack app, the web panel, warm_cache.py) never overwrite each other's names.
+    """
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, palette_colors=8, background_color=(0,0,0),
+                 sizes=Zhuanhuan.TARGET_SIZES, max_entries=256, quantize='adaptive'):
+        self.store_dir = store_dir
+        self.sizes = tuple(sizes)
+        self.params = {
+            'palette_colors': palette_colors,
+            'background_color': list(background_color),
+            'sizes': list(self.sizes),
+            'quantize': quantize
+        }
+        self.params_digest = hashlib.sha256(json.dumps(self.params, sort_keys=True).encode()).hexdigest()[:12]
+        self.max_entries = max_entries
+        self.names = {}
+        # Pointers queued for the writer but not on disk yet, a reload must not lose them
+        self.pending = {}
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+        # Single thread so writes of a pointer happen in order
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="emoji-store")
+        self.stats = {
+            'processed': 0,
+            'shared': 0,
+            'hits': 0,
+            'misses': 0
+        }
+        self.load()
+
+    def _names_file(self):
+        # Names of stores from before the pointer files, only read
+        return os.path.join(self.store_dir, "names.json")
+
+    def _pointer_file(self, name):
+        # Hashed so any emoji name is a valid file name, also on case insensitive file systems
+        return os.path.join(self.store_dir, "names", hashlib.sha256(name.encode('utf-8')).hexdigest() + ".json")
+
+    def _read_pointer(self, path):
+        # (name, key) of a pointer file or None if it is missing or unreadable
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                pointer = json.load(f)
+            return pointer['name'], pointer['key']
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[EmojiStore] Ignoring unreadable pointer {path}: {e}")
+            return None
+
+    def _object_dir(self, key):
+        return os.path.join(self.store_dir, "objects", key)
+
+    def load(self):
+        """Reads every name from disk, pointers still waiting to be written are kept"""
+        names = {}
+        try:
+            with open(self._names_file(), 'r', encoding='utf-8') as f:
+                names.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"[EmojiStore] Ignoring unreadable names file: {e}")
+        names_dir = os.path.join(self.store_dir, "names")
+        try:
+            filenames = os.listdir(names_dir)
+        except FileNotFoundError:
+            filenames = []
+        for filename in filenames:
+            if filename.endswith(".json"):
+                pointer = self._read_pointer(os.path.join(names_dir, filename))
+                if pointer:
+                    names[pointer[0]] = pointer[1]
+        names.update(self.pending)
+        self.names = names
+
+    def key(self, data):
+        """Key of a source image: its hash plus the hash of the processing parameters"""
+        return f"{hashlib.sha256(data).hexdigest()}-{self.params_digest}"
+
+    def _remember(self, key, frames):
+        self.frames[key] = frames
+        self.frames.move_to_end(key)
+        while len(self.frames) > self.max_entries:
+            self.frames.popitem(last=False)
+
+    def _load_frames(self, key):
+        # Memory first, then the processed files of the object (call with lock held)
+        frames = self.frames.get(key)
+        if frames is not None:
+            self.frames.move_to_end(key)
+            return frames
+        object_dir = self._object_dir(key)
+        try:
+            frames = {}
+            for size in self.sizes:
+                gif_path = os.path.join(object_dir, f"{size}.gif")
+                if os.path.exists(gif_path):
+                    with open(gif_path, 'rb') as f:
+                        frames[size] = f.read()
+                    continue
+                with Image.open(os.path.join(object_dir, f"{size}.png")) as img:
+                    frames[size] = img.convert("RGB")
+        except (OSError, ValueError):
+            return None
+        self._remember(key, frames)
+        return frames
+
+    def _save_object(self, key, frames):
+        try:
+            object_dir = self._object_dir(key)
+            os.makedirs(object_dir, exist_ok=True)
+            for size, frame in frames.items():
+                # Every file appears complete or not at all, a killed writer leaves no truncated frame behind
+                path = os.path.join(object_dir, f"{size}.gif" if isinstance(frame, bytes) else f"{size}.png")
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                if isinstance(frame, bytes):
+                    with open(tmp_path, 'wb') as f:
+                        f.write(frame)
+                else:
+                    frame.save(tmp_path, format="PNG")
+                os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[EmojiStore] Failed to save {key}: {e}")
+
+    def _is_saved(self, key):
+        # An object is only usable once the frame of every display size is on disk
+        object_dir = self._object_dir(key)
+        return all(
+            os.path.exists(os.path.join(object_dir, f"{size}.png")) or os.path.exists(os.path.join(object_dir, f"{size}.gif"))
+            for size in self.sizes
+        )
+
+    def _save_pointer(self, name, key):
+        try:
+            path = self._pointer_file(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'name': name, 'key': key}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[EmojiStore] Failed to save the pointer of {name}: {e}")
+        with self.lock:
+            if self.pending.get(name) == key:
+                del self.pending[name]
+
+    def _point(self, name, key):
+        # Call with lock held, the pointer file is only rewritten if the pointer changed
+        if self.names.get(name) != key:
+            self.names[name] = key
+            self.pending[name] = key
+            self.writer.submit(self._save_pointer, name, key)
+
+    def put(self, name, data):
+        """Frames ({size: image}) of a downloaded image, processed only if its content wasn't seen before"""
+        key = self.key(data)
+        with self.lock:
+            frames = self._load_frames(key)
+            if frames is not None:
+                self.stats['shared'] += 1
+                self._point(name, key)
+                return frames
+        # Animated emojis keep their animation as a GIF per size
+        process = Zhuanhuan.process_animation if Zhuanhuan.is_animated(data) else Zhuanhuan.preprocess_multi
+        frames = process(
+            io.BytesIO(data), sizes=self.sizes,
+            palette_colors=self.params['palette_colors'],
+            background_color=tuple(self.params['background_color']),
+            quantize=self.params['quantize']
+        )
+        with self.lock:
+            self.stats['processed'] += 1
+            self._remember(key, frames)
+            self.writer.submit(self._save_object, key, frames)
+            self._point(name, key)
+        return frames
+
+    def alias(self, name, target):
+        """Points name at the artifact of target, returns False if target isn't stored"""
+        with self.lock:
+            key = self.names.get(target)
+            if key is None:
+                return False
+            self._point(name, key)
+            return True
+
+    def has(self, name):
+        """True if name points at an artifact whose frames were all saved to disk"""
+        with self.lock:
+            key = self.names.get(name)
+        return key is not None and self._is_saved(key)
+
+    def flush(self):
+        """Waits until every queued object and pointer write has finished"""
+        self.writer.submit(lambda: None).result()
+
+    def get(self, name):
+        """Frames ({size: image}) stored under name or None"""
+        with self.lock:
+            key = self.names.get(name)
+            if key is None:
+                # Names stored by another process (the Slack app) since this store was loaded
+                pointer = self._read_pointer(self._pointer_file(name))
+                if pointer:
+                    key = self.names[name] = pointer[1]
+            frames = self._load_frames(key) if key else None
+            self.stats['hits' if frames is not None else 'misses'] += 1
+            return frames
+
+    def get_status(self):
+        with self.lock:
+            return {
+                **self.stats,
+                'names': len(self.names),
+                'artifacts': len(set(self.names.values())),
+                'in_memory': len(self.frames)
+            }
@@ -0,0 +1,91 @@
+import os
+import threading
+
+# One index per directory
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class NameIndex:
+    """
+    In memory map of file names without extension to the files of one directory.
+    Built with a single directory listing, writers keep it up to date with add() and discard().
+    Lookups are a dict access, only a miss checks whether the directory was changed by someone else.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self.lock = threading.Lock()
+        self.directory_mtime = None
+        self.built = False
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'rebuilds': 0
+        }
+
+    def _rebuild(self):
+        files = {}
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+            # Sorted so the same file wins for a name whatever order the file system lists them
+            for filename in sorted(os.listdir(self.directory)):
+                name, _ = os.path.splitext(filename)
+                if not name.startswith('.'):
+                    files.setdefault(name, filename)
+        except FileNotFoundError:
+            mtime = None
+        self.files = files
+        self.directory_mtime = mtime
+        self.built = True
+        self.stats['rebuilds'] += 1
+
+    def _changed(self):
+        try:
+            return os.stat(self.directory).st_mtime_ns != self.directory_mtime
+        except FileNotFoundError:
+            return self.directory_mtime is not None
+
+    def lookup(self, name):
+        """Path of the file called name (without extension) or None"""
+        with self.lock:
+            if not self.built:
+                self._rebuild()
+            filename = self.files.get(name)
+            if filename is None and self._changed():
+                # Files written by another process, e.g. a batch_process run from the command line
+                self._rebuild()
+                filename = self.files.get(name)
+            if filename is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            return os.path.join(self.directory, filename)
+
+    def add(self, filename):
+        """Records a file which was just written to the directory, it replaces a file of the same name"""
+        name, _ = os.path.splitext(os.path.basename(filename))
+        with self.lock:
+            self.files[name] = os.path.basename(filename)
+
+    def discard(self, filename):
+        """Forgets a file which was removed from the directory"""
+        filename = os.path.basename(filename)
+        name, _ = os.path.splitext(filename)
+        with self.lock:
+            if self.files.get(name) == filename:
+                del self.files[name]
+
+    def get_status(self):
+        with self.lock:
+            return {**self.stats, 'directory': self.directory, 'files': len(self.files)}
+
+
+def index_for(directory):
+    """Get the index of a directory, created on first use"""
+    key = os.path.abspath(directory)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = NameIndex(directory)
+        return _indexes[key]
@@ -4,11 +4,12 @@ from admin_panel.web.web_app import register_routes as register_panel_routes
 from admin_panel.managers.admin_manager import register_api_routes
 import requests
 import emoji
-import subprocess
-import Zhuanhuan
 from slack_sdk import WebClient
 import start_up_file
-import threading
+from command_coalescer import coalescer_for
+from emoji_store import EmojiStore
+from core.daemon import DisplayDaemon
+from core.daemon_client import send_command, DaemonError
 import time
 
 # —— inject admin modules
@@ -61,14 +62,20 @@ mac_address = start_up_file.mac_address
 SLACK_BOT_TOKEN = os.environ.get("SLACK_BOT_TOKEN")
 client = WebClient(token=SLACK_BOT_TOKEN)
 
-# Obtains the image from the custom emoji aswell as client emojis through the slash command, sends it to the input file and then process continues to the output images
+# Processed emojis by content, names and aliases pointing at the same image share one processed frame set
+emoji_store = EmojiStore()
+
+# Obtains the image from the custom emoji aswell as client emojis through the slash command, returns the url of the emoji
 def get_emoji_url(emoji_name):
+    url, _ = get_emoji_frame(emoji_name)
+    return url
+
+
+# Downloads the emoji and processes it in memory, returns the url and the display ready frames by display size (or None, None)
+# Frames are kept in the emoji store, an image that was seen before under any name is not processed again
+def get_emoji_frame(emoji_name):
     name_e = emoji_name.replace(":", "")
     
-    # Ensure input directory exists
-    os.makedirs("input", exist_ok=True)
-    os.makedirs("output", exist_ok=True)
-    
     # Finding the emoji using get_emoji_url function that adds emoji to input folder
     try:
         # Grabs emoji alies name
@@ -76,17 +83,17 @@ def get_emoji_url(emoji_name):
         # If it find the name search for the png using the get_standard_emoji call
         if emoji_char != emoji_name:
             url = get_standard_emoji_url(emoji_char)
+            # Standard emojis prebuilt by warm_cache.py need no download
+            frames = emoji_store.get(name_e)
+            if frames is not None:
+                return url, frames
             try:
                 response = requests.get(url, timeout=10)
                 response.raise_for_status()  # Raises exception for bad status codes
                 
-                # Adding newly found emoji file to input folder which adds it as a png
-                with open(f"input/{name_e}.png", "wb") as file:
-                    file.write(response.content)
-                
-                # processed the file with the new name as a 16 x 16 pixel png which gets added to output folder
-                Zhuanhuan.batch_process_single_file(name_e)
-                return url
+                # processed straight from the response into a frame per display size
+                frames = emoji_store.put(name_e, response.content)
+                return url, frames
             except requests.RequestException as e:
                 print(f"Failed to download standard emoji: {e}")
     except Exception as e:
@@ -104,23 +111,24 @@ def get_emoji_url(emoji_name):
             # Handle aliases
             if url.startswith("alias:"):
                 alias = url.split("alias:")[1]
-                return get_emoji_url(f":{alias}:")
+                url, frames = get_emoji_frame(f":{alias}:")
+                # The alias name only points at the frames of the original emoji
+                if frames is not None:
+                    emoji_store.alias(name_e, alias)
+                return url, frames
             
             # Download custom emoji from slack client
             try:
                 response = requests.get(url, timeout=10)
                 response.raise_for_status()
                 
-                with open(f"input/{name_e}.png", "wb") as f:
-                    f.write(response.content)
-                
-                Zhuanhuan.batch_process_single_file(name_e)
-                return url
+                frames = emoji_store.put(name_e, response.content)
+                return url, frames
             except requests.RequestException as e:
                 print(f"Failed to download custom emoji: {e}")
     except Exception as e:
         print(f"Custom emoji processing failed: {e}")
-    return None
+    return None, None
 
 #Endpoint to which the slack events are received which are cnnected via a challenge request response
 @app.route('/slack/events', methods=['POST'])
@@ -167,21 +175,31 @@ def slack_command():
     # Default return to the slack workspace
     response_to_slack = f"{user} sent {gathering_text} to the pixel display - enter '-help' or '-h' for command list"
 
+    # Commands of the display run on its own worker, queued emojis are superseded by newer ones
+    display_queue = coalescer_for(start_up_file.get_mac_address())
+
     # Background processing as wait times for executions would timeout the slack workspace
     if(status != State.OFF):
         # Only processes if screen isn't off
         def background_processing():
             try:
-                    get_emoji_url(gathering_text)
-                    start_up_file.send_image_to_display(gathering_text)
+                    # Emojis of the prebuilt emoji pack need no download or processing
+                    if start_up_file.send_packed_emoji(gathering_text):
+                        print(f"Successfully processed {gathering_text}")
+                        return
+                    _, frames = get_emoji_frame(gathering_text)
+                    # Frames stored earlier under this name are used if the download failed
+                    if frames is None:
+                        frames = emoji_store.get(gathering_text.replace(":", ""))
+                    # Frame goes to the display from memory, the output folder is the last fallback
+                    if frames is None or not start_up_file.send_frame_to_display(frames):
+                        start_up_file.send_image_to_display(gathering_text)
                     print(f"Successfully processed {gathering_text}")
             except Exception as e:
                     print(f"Error processing {gathering_text}: {e}")
             
-        # Start background thread for image displaying
-        thread = threading.Thread(target=background_processing)
-        thread.daemon = True
-        thread.start()
+        # Queue image displaying, only the newest not yet started emoji is shown
+        display_queue.submit_content(gathering_text, background_processing)
 
     # For commands that are multi input, are splits and viewed individually i.e 'coffee 5' or 'cancel timer'
     split_input = gathering_text.split()
@@ -209,10 +227,8 @@ def slack_command():
                         print(f"Error setting timer: {e}")
                         status = State.ON 
                 
-                # Threads executing the call so it doesnt block timing executions
-                thread = threading.Thread(target=set_timer_background)
-                thread.daemon = True
-                thread.start()
+                # Queued in order on the display worker so it doesnt block timing executions
+                display_queue.submit("timer", set_timer_background)
 
                 return f"{user}: set timer for {coffeeTime} minutes, to cancel the timer type (/emoji cancel timer)", 200
             
@@ -223,21 +239,19 @@ def slack_command():
         # Cancels the timer based on input response from user
         elif status == State.TIMER and gathering_text == 'cancel timer':
             def cancel_timer_background():
+                global status
                 try:
                     mac_add = start_up_file.get_mac_address()
-                    off_timer = f"python .\\app.py --address {mac_add} --countdown 0"
 
-                    #Runs the command to turn off the timer
-                    result = subprocess.run(off_timer, shell=True, check=True, capture_output=True, text=True)
+                    #Sends the command to turn off the timer to the display daemon
+                    send_command(["--address", mac_add, "--countdown", "0"])
                     print("Timer cancelled successfully")
                     status = State.ON
-                except subprocess.CalledProcessError as e:
+                except DaemonError as e:
                     print(f"Failed to turn off timer: {e}")
             
             # Cancel the timer in background
-            cancel_thread = threading.Thread(target=cancel_timer_background)
-            cancel_thread.daemon = True
-            cancel_thread.start()
+            display_queue.submit("cancel timer", cancel_timer_background)
             
             # Return immediate response to Slack
             return f"{user}: timer cancelled", 200
@@ -247,16 +261,14 @@ def slack_command():
         def sleep_pixel_display():
             global status 
             try:
-                print("screen off successfully")
                 start_up_file.turn_screen_off()
+                print("screen off successfully")
                 status = State.OFF
-            except subprocess.CalledProcessError as e:
-                print(f"screen of failed: {e}")
+            except DaemonError as e:
+                print(f"screen off failed: {e}")
 
-        # Runs screen off thread
-        off_thread = threading.Thread(target=sleep_pixel_display)
-        off_thread.daemon = True
-        off_thread.start()
+        # Runs screen off on the display worker
+        display_queue.submit("sleep", sleep_pixel_display)
 
         return "the pixel display is sleeping, to reactivate enter: /emoji awake"
 
@@ -270,13 +282,11 @@ def slack_command():
                     start_up_file.turn_screen_on()
                     print("screen on succesful")
                     status = State.ON
-                except subprocess.CalledProcessError as e:
-                    print(f"screen of failed: {e}")
+                except DaemonError as e:
+                    print(f"screen on failed: {e}")
         
-            # Runs screen on thread
-            on_thread = threading.Thread(target=awaken_pixel_display)
-            on_thread.daemon = True
-            on_thread.start()
+            # Runs screen on on the display worker
+            display_queue.submit("awake", awaken_pixel_display)
 
             return f"{user}: pixel display is now awake!", 200
     
@@ -311,6 +321,8 @@ def admin_logs():
 if __name__ == "__main__":
     # These files trigger upon entry into the flask app for the setup of the IDotMatrix controller sync
     start_up_file.start_up()
+    # Long-lived display daemon which keeps the bluetooth connection open for every following command
+    DisplayDaemon().start_background()
     start_up_file.find_mac_address()
     start_up_file.set_mac_address()
     app.run(debug=False, port=8888) 
\ No newline at end of file
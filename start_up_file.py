@@ -1,9 +1,24 @@
 import subprocess   
 import os
+import struct
+from core.daemon_client import send_command, send_frame, send_gif, DaemonError
+from core.discovery import DiscoveryCache, find_display
+from name_index import index_for
+from Zhuanhuan import output_dir_for
+from emoji_pack import EmojiPack
 
 # Global mac address for shared use
 mac_address = None
 
+# Resolution of the pixel display, selects which processed variant of an image is sent
+display_size = int(os.environ.get("IDOTMATRIX_DISPLAY_SIZE", 16))
+
+# Memory mapped emoji pack built by Zhuanhuan --pack, opened on first use
+emoji_pack = None
+
+# Known display addresses with last seen timestamps, persisted across restarts
+discovery_cache = DiscoveryCache()
+
 # 系统状态跟踪
 system_status = {
     'device_connected': False,
@@ -59,27 +74,24 @@ def start_up():
         print(f"Error running PowerShell script: {e}")
 
 
-# Using the pixel display controllers scan command to locate scanned mac addresses
+# Locates the pixel display, a recently seen display is taken from the discovery cache without scanning
 def find_mac_address():
     global mac_address 
 
-    mac_command = "python .\\app.py --scan"
-    
     try:
         print("Scanning")
-        mac = subprocess.run(mac_command, capture_output=True, text=True, shell=True, check=True)
-
-        # Finds the mac address then sets it as the global variable
-        mac_address = mac.stdout.strip()
-        split_mac_address(mac.stdout, mac.stderr)
-
-        print(mac.stderr)
+        # Targeted scan stops as soon as a known or iDotMatrix display shows up
+        mac = find_display(discovery_cache)
+        if mac is None:
+            print("Failed to find MAC address: no display found")
+            return None
+
+        # Sets the found mac address as the global variable
+        mac_address = mac.upper()
+        print(f"is mac address {mac_address}")
+        return mac_address
     
     # Error handling for unable to find mac address
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to find MAC address: {e}")
-        print(f"Error output: {e.stderr}")
-        return None
     except Exception as e:
         print(f"Unexpected error finding MAC address: {e}")
         return None
@@ -94,20 +106,28 @@ def set_mac_address():
         print("No MAC address available. Run find_mac_address() first.")
         return
     
-    # Sets the address of the pixel display, which triggers a sync symbol on the pixel display
-    address_sync = f"python .\\app.py --address {mac_address}"  
-
     print(f"The MAC address is: {mac_address}")
 
-    # Command ran in try for error handling
+    # Sets the address of the pixel display, the display daemon connects and keeps the connection open
     try:
-        address_results = subprocess.run(address_sync, shell=True, check=True, capture_output=True, text=True)
+        try:
+            send_command(["--address", mac_address])
+        except DaemonError as e:
+            # The cached address may be stale (display moved or out of range), forget it and scan once
+            print(f"Could not connect to {mac_address}: {e}, scanning again")
+            discovery_cache.forget(mac_address)
+            mac = find_display(discovery_cache, use_cache=False)
+            if mac is None:
+                raise
+            mac_address = mac.upper()
+            print(f"is mac address {mac_address}")
+            send_command(["--address", mac_address])
+        discovery_cache.remember(mac_address)
         print("MAC address has been setup for pixel display")
         update_status("set_mac_address", True)
             
-    except subprocess.CalledProcessError as e:
+    except DaemonError as e:
         print(f"Failed to set MAC address: {e}")
-        print(f"Error output: {e.stderr}")
     except Exception as e:
         print(f"Unexpected error setting MAC address: {e}")
 
@@ -133,75 +153,130 @@ def get_mac_address():
     global mac_address
     return mac_address
 
+# Returns the emoji pack, reopened when it was rebuilt
+def get_emoji_pack():
+    global emoji_pack
+    if emoji_pack is None or emoji_pack.changed():
+        emoji_pack = EmojiPack()
+    return emoji_pack
+
+
+# Sends an emoji straight from the emoji pack, returns False if the pack doesn't have it
+def send_packed_emoji(image):
+    global mac_address
+
+    try:
+        frame = get_emoji_pack().frame(image.replace(":", ""), display_size)
+    except (ValueError, struct.error) as e:
+        # struct.error: a file too short for the pack header
+        print(f"Emoji pack unusable: {e}")
+        return False
+    if frame is None:
+        return False
+
+    try:
+        # The frame is a view into the memory mapped pack, no file lookup or decode
+        send_frame(frame, display_size, mac_address)
+        print(f"Image {image} sent to display from the emoji pack.")
+        update_status("send_image", True)
+        return True
+    except DaemonError as e:
+        print(f"Failed to send packed emoji: {e}")
+        return False
+
+
 # Calls the controllers image command to prudice the image to the pixel display
 def send_image_to_display(image):
     #  Asessing the global mac address
     global mac_address
 
-    # Setting dir as output
-    directory = "output"
+    # The output folder of the display's resolution, callers try the emoji pack first
+    directory = output_dir_for("output", display_size)
 
     # Removing the colon from emoji texts i.e turning ':smiley_face:' to 'smiley_face'
     image_name = image.replace(":", "")
-    image_path = os.path.join(directory, f"{image_name}.png")
 
-
-    # Returns if path doesnt exist
-    if not os.path.exists(image_path):
+    # Looked up in the in memory index of the output folder, returns if the image doesnt exist
+    image_path = index_for(directory).lookup(image_name)
+    if image_path is None:
         print("image does not exist")
         return 
     
     print(f"this is the image_path {image_path}")
     
-    set_image_command = f"python .\\app.py --address {mac_address} --image true --set-image {image_path}"
-                        
     try:
-        # Command ran for image setting to the pixel display, this command finishes the tranfer from back end to pixel display
-        result = subprocess.run(set_image_command, shell=True, check=True, capture_output=True, text=True)
+        # Command sent to the display daemon, this command finishes the tranfer from back end to pixel display
+        send_command(["--address", mac_address, "--image", "true", "--set-image", image_path])
         print(f"Image {image} sent to display successfully.")
         update_status("send_image", True)
-    except subprocess.CalledProcessError as e:
+    except DaemonError as e:
         print(f"Failed to send image: {e}")
 
 
+# Sends an already processed frame straight to the display daemon, no image file involved
+# Frames are the {size: image} variants of Zhuanhuan, the one of the display's resolution is sent
+# Animated emojis are GIF bytes instead of an image and are uploaded as a GIF
+def send_frame_to_display(frames):
+    global mac_address
+
+    frame = frames.get(display_size)
+    if frame is None:
+        print(f"No {display_size}x{display_size} variant of the frame")
+        return False
+
+    try:
+        if isinstance(frame, bytes):
+            send_gif(frame, mac_address)
+        else:
+            send_frame(frame.convert("RGB").tobytes(), frame.width, mac_address)
+        print("Frame sent to display successfully.")
+        update_status("send_image", True)
+        return True
+    except DaemonError as e:
+        print(f"Failed to send frame: {e}")
+        return False
+
+
 # Command for setting timer time
 def set_timer(minutes):
     global mac_address
     
-    set_image_command = f"python .\\app.py --address {mac_address} --countdown 1 --countdown-time {minutes}-0"
-                        
     try:
-        result = subprocess.run(set_image_command, shell=True, check=True, capture_output=True, text=True)
+        send_command(["--address", mac_address, "--countdown", "1", "--countdown-time", f"{minutes}-0"])
         print(f"Timer is set")
         update_status("set_timer", True)
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to send image: {e}")
+    except DaemonError as e:
+        print(f"Failed to set timer: {e}")
+        update_status("set_timer", False)
+        raise
 
 # Command for turning off the screen
 def turn_screen_off():
     global mac_address
     
-    set_image_command = f"python .\\app.py --address {mac_address} --screen off"
-                        
     try:
-        result = subprocess.run(set_image_command, shell=True, check=True, capture_output=True, text=True)
+        send_command(["--address", mac_address, "--screen", "off"])
         print(f"screen is turned off")
         update_status("screen_off", True)
-    except subprocess.CalledProcessError as e:
+    except DaemonError as e:
         print(f"Failed to turn screen off {e}")
+        update_status("screen_off", False)
+        # Callers only change the display state if the command went through
+        raise
 
 # Command for turning on the screen
 def turn_screen_on():
     global mac_address
     
-    set_image_command = f"python .\\app.py --address {mac_address} --screen on"
-                        
     try:
-        result = subprocess.run(set_image_command, shell=True, check=True, capture_output=True, text=True)
+        send_command(["--address", mac_address, "--screen", "on"])
         print(f"screen is turned on")
         update_status("screen_on", True)
-    except subprocess.CalledProcessError as e:
+    except DaemonError as e:
         print(f"Failed to turn screen on {e}")
+        update_status("screen_on", False)
+        # Callers only change the display state if the command went through
+        raise
 
 # Checks if the pixel display is returning a mac address
 def check_if_connected():
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from idotmatrix import ConnectionManager
+from idotmatrix.const import UUID_READ_DATA
+from core.upload import UploadEngine
+
+
+class FakeCharacteristic:
+
+    def __init__(self, properties):
+        self.properties = properties
+        self.max_write_without_response_size = 20
+
+
+class FakeClient:
+    """A connected display which takes every write but never sends a notification"""
+
+    def __init__(self, address, read_properties):
+        self.address = address
+        self.is_connected = True
+        self.writes = []
+        self.characteristics = {'write': FakeCharacteristic(['write-without-response', 'write']),
+                                'read': FakeCharacteristic(read_properties)}
+        self.services = self
+
+    def get_characteristic(self, uuid):
+        return self.characteristics['read' if uuid == UUID_READ_DATA else 'write']
+
+    async def write_gatt_char(self, uuid, data, response=False):
+        self.writes.append((bytes(data), response))
+
+    async def start_notify(self, uuid, callback):
+        pass
+
+    async def stop_notify(self, uuid):
+        pass
+
+
+class SilentDisplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = ConnectionManager()
+        self.saved = (self.conn.address, self.conn.client)
+        UploadEngine.acknowledged_only.clear()
+
+    def tearDown(self):
+        self.conn.address, self.conn.client = self.saved
+        UploadEngine.acknowledged_only.clear()
+
+    def upload(self, client, chunks, ack_timeout=0.05):
+        self.conn.address, self.conn.client = client.address, client
+        return asyncio.run(UploadEngine(window=4, ack_timeout=ack_timeout).upload(chunks))
+
+    def assert_acknowledged(self, client, chunks):
+        # every chunk ends up written with response, in order
+        acknowledged = b''.join(data for data, response in client.writes if response)
+        self.assertEqual(acknowledged, b''.join(chunks))
+
+    def test_without_notify_support_uses_acknowledged_writes_right_away(self):
+        client = FakeClient('AA:BB', ['read'])
+        chunks = [b'x' * 30]
+        start = time.perf_counter()
+        stats = self.upload(client, chunks, ack_timeout=2.0)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(stats['pipelined_chunks'], 0)
+        self.assertTrue(all(response for _, response in client.writes))
+        self.assert_acknowledged(client, chunks)
+
+    def test_missing_final_acks_restart_the_upload_and_stick(self):
+        client = FakeClient('AA:CC', ['notify'])
+        chunks = [b'a' * 30, b'b' * 10]
+        stats = self.upload(client, chunks)
+        self.assertTrue(stats['restarted'])
+        self.assertEqual(stats['pipelined_chunks'], 0)
+        self.assert_acknowledged(client, chunks)
+        # the next upload over the same connection doesn't try pipelining again
+        client.writes.clear()
+        stats = self.upload(client, chunks)
+        self.assertFalse(stats['restarted'])
+        self.assertTrue(all(response for _, response in client.writes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import emoji
+import requests
+from emoji_list import emojiList
+from emoji_pack import DEFAULT_PACK_FILE, write_pack
+from emoji_store import EmojiStore
+
+TWEMOJI_URL = "https://cdn.jsdelivr.net/gh/twitter/twemoji@latest/assets/72x72/{}.png"
+DEFAULT_SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "twemoji")
+
+
+def twemoji_codepoints(emoji_char):
+    """Codepoints of an emoji as used in the twemoji file names, e.g. 1f44d"""
+    return '-'.join(f"{ord(char):x}" for char in emoji_char)
+
+
+def twemoji_url(emoji_char):
+    return TWEMOJI_URL.format(twemoji_codepoints(emoji_char))
+
+
+def resolve(name):
+    """Emoji character of a name from emojiList (without colons) or None if it isn't a standard emoji"""
+    alias = f":{name}:"
+    emoji_char = emoji.emojize(alias, language="alias")
+    return emoji_char if emoji_char != alias else None
+
+
+def _candidates(emoji_char):
+    # Twemoji drops the variation selector from most single emoji file names
+    codepoints = twemoji_codepoints(emoji_char)
+    candidates = [codepoints]
+    if '200d' not in codepoints and '-fe0f' in codepoints:
+        candidates.append(codepoints.replace('-fe0f', ''))
+    return candidates
+
+
+def fetch_source(emoji_char, source_dir=DEFAULT_SOURCE_DIR, offline=False):
+    """
+    PNG bytes of the twemoji art of an emoji, from source_dir if it was fetched before (or copied there),
+    otherwise downloaded and kept in source_dir. Returns None if it can't be found.
+    """
+    candidates = _candidates(emoji_char)
+    for codepoints in candidates:
+        try:
+            with open(os.path.join(source_dir, f"{codepoints}.png"), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+    if offline:
+        return None
+    for codepoints in candidates:
+        response = requests.get(TWEMOJI_URL.format(codepoints), timeout=10)
+        if response.status_code == 404:
+            continue
+        response.raise_for_status()
+        os.makedirs(source_dir, exist_ok=True)
+        tmp_path = os.path.join(source_dir, f"{codepoints}.png.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(response.content)
+        os.replace(tmp_path, os.path.join(source_dir, f"{codepoints}.png"))
+        return response.content
+    return None
+
+
+def warm_cache(names=emojiList, store=None, source_dir=DEFAULT_SOURCE_DIR, workers=4, offline=False, force=False):
+    """
+    Processes every standard emoji of names into the emoji store so the first use of an emoji needs no download.
+    Emojis whose frames are all in the store are skipped, so an interrupted run continues where it stopped
+    and processes half saved emojis again. Safe while the Slack app or web panel use the same store.
+    Returns a summary dict.
+    """
+    store = store if store is not None else EmojiStore()
+    start = time.perf_counter()
+    summary = {
+        'total': len(names),
+        'processed': 0,
+        'skipped': 0,
+        'unresolved': [],
+        'failed': [],
+        'seconds': 0.0
+    }
+    lock = threading.Lock()
+    done = [0]
+
+    def report(name, state):
+        with lock:
+            done[0] += 1
+            elapsed = time.perf_counter() - start
+            rate = done[0] / elapsed if elapsed > 0 else 0.0
+            print(f"[{done[0]}/{summary['total']}] {name}: {state} ({rate:.1f} emojis/s)")
+
+    def warm(name):
+        emoji_char = resolve(name)
+        if emoji_char is None:
+            return name, 'unresolved', None
+        try:
+            data = fetch_source(emoji_char, source_dir, offline)
+            if data is None:
+                return name, 'failed', "no twemoji art found"
+            store.put(name, data)
+            return name, 'processed', None
+        except Exception as e:
+            return name, 'failed', str(e)
+
+    pending = []
+    for name in names:
+        if not force and store.has(name):
+            summary['skipped'] += 1
+            report(name, "cached")
+        else:
+            pending.append(name)
+
+    # Threads overlap the downloads with the processing of other emojis
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="warm-cache") as pool:
+        for future in as_completed([pool.submit(warm, name) for name in pending]):
+            name, state, error = future.result()
+            if state == 'processed':
+                summary['processed'] += 1
+            else:
+                summary[state].append(name if error is None else f"{name}: {error}")
+            report(name, state if error is None else f"{state} ({error})")
+
+    # Names file and objects are written in the background, the run only counts once they are on disk
+    store.flush()
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def pack_store(names=emojiList, store=None, pack_path=DEFAULT_PACK_FILE):
+    """Writes the still frames of every stored emoji of names into the emoji pack, returns the number of packed names"""
+    store = store if store is not None else EmojiStore()
+
+    def entries():
+        for name in names:
+            frames = store.get(name)
+            # Animated emojis are GIF bytes, the pack only holds still frames
+            if frames is None or any(isinstance(frame, bytes) for frame in frames.values()):
+                continue
+            yield name, {size: frame.convert("RGB").tobytes() for size, frame in frames.items()}
+
+    return write_pack(entries(), pack_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Processes every standard emoji of emoji_list into the emoji cache")
+    parser.add_argument('--workers', type=int, default=4, help="emojis fetched and processed at a time")
+    parser.add_argument('--source-dir', default=DEFAULT_SOURCE_DIR,
+                        help="twemoji 72x72 png files, missing ones are downloaded into it")
+    parser.add_argument('--offline', action='store_true', help="only use the files of the source dir")
+    parser.add_argument('--force', action='store_true', help="process emojis which are already cached again")
+    parser.add_argument('--pack', nargs='?', const=DEFAULT_PACK_FILE,
+                        help="also write the emojis into the emoji pack (default cache/emoji.pack)")
+    args = parser.parse_args()
+
+    store = EmojiStore()
+    summary = warm_cache(store=store, source_dir=args.source_dir, workers=args.workers,
+                         offline=args.offline, force=args.force)
+    for failure in summary['failed']:
+        print(f"Failed: {failure}")
+    print(f"{summary['processed']} processed, {summary['skipped']} already cached, "
+          f"{len(summary['unresolved'])} not standard emojis, {len(summary['failed'])} failed "
+          f"in {summary['seconds']:.1f}s")
+    if args.pack:
+        count = pack_store(store=store, pack_path=args.pack)
+        print(f"Packed {count} emojis into {args.pack}")
@@ -0,0 +1,62 @@
+import argparse
+import os
+import time
+import numpy as np
+import Zhuanhuan
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+
+
+def collect_images(directories):
+    # Every image file of the given directories, sorted for repeatable runs
+    paths = []
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(directory, filename))
+    return paths
+
+
+def run_pil(paths, palette_colors, quantize='adaptive'):
+    return np.stack([np.asarray(Zhuanhuan.preprocess_for_16x16(path, palette_colors=palette_colors, quantize=quantize)) for path in paths])
+
+
+def run_pil_fixed(paths, palette_colors):
+    return run_pil(paths, palette_colors, 'fixed')
+
+
+def benchmark(name, engine, paths, palette_colors, repeat):
+    # Best of the repeats so a cold cache or a busy Pi doesn't distort the number
+    times = []
+    frames = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frames = engine(paths, palette_colors)
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    print(f"{name:>12}: {len(paths) / best:8.1f} images/s (best of {repeat}, {best * 1000:.1f} ms for {len(paths)} images)")
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the Zhuanhuan pipeline with adaptive and fixed palettes")
+    parser.add_argument('dirs', nargs='*', default=['input', 'images'], help="directories with source images")
+    parser.add_argument('--repeat', type=int, default=5, help="number of timed runs per palette")
+    parser.add_argument('--copies', type=int, default=10, help="how often every image is put into the batch")
+    parser.add_argument('--palette-colors', type=int, default=8)
+    args = parser.parse_args()
+
+    paths = collect_images(args.dirs)
+    if not paths:
+        print("No images found")
+        return
+    batch = paths * args.copies
+
+    benchmark("pil", run_pil, batch, args.palette_colors, args.repeat)
+    # Fixed palette lookup table instead of an adaptive palette per image
+    benchmark("pil fixed", run_pil_fixed, batch, args.palette_colors, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import PIL
+from PIL import Image
+import Zhuanhuan
+from zhuanhuan_benchmark import collect_images
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak RSS is left out there
+    resource = None
+
+STAGES = ('decode', 'convert', 'alpha_bbox', 'crop', 'resize', 'composite', 'quantize', 'png_save')
+DEFAULT_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "zhuanhuan_stages.json")
+
+
+def run_stages(path, size, palette_colors, background_color, quantize, clock=time.perf_counter, mark=None, buffers=None):
+    """
+    One run of the preprocess_for_16x16 pipeline split into its stages, same calls as _crop_square and _finish.
+    Returns {stage: seconds}, mark(stage) is called before every stage (used for the memory pass)
+    and buffers gets the pixel buffer size of the image every stage produced.
+    """
+    times = {}
+    mark = mark or (lambda stage: None)
+
+    def timed(stage, func):
+        mark(stage)
+        start = clock()
+        result = func()
+        times[stage] = clock() - start
+        if buffers is not None and isinstance(result, Image.Image):
+            buffers[stage] = result.width * result.height * len(result.getbands())
+        return result
+
+    def decode():
+        img = Image.open(path)
+        img.load()
+        return img
+
+    img = timed('decode', decode)
+    img = timed('convert', lambda: img.convert("RGBA"))
+    box = timed('alpha_bbox', lambda: Zhuanhuan._square_box(img))
+    img = timed('crop', lambda: img.crop(box))
+    img = timed('resize', lambda: img.resize((size, size), Image.LANCZOS))
+
+    def composite():
+        bg = Image.new("RGB", (size, size), background_color)
+        bg.paste(img, mask=img.split()[3])
+        return bg
+
+    bg = timed('composite', composite)
+
+    def quantize_stage():
+        if quantize == 'fixed':
+            return Image.fromarray(Zhuanhuan.quantize_fixed(np.asarray(bg)))
+        return bg.convert("P", palette=Image.ADAPTIVE, colors=palette_colors).convert("RGB")
+
+    out = timed('quantize', quantize_stage)
+    timed('png_save', lambda: out.save(io.BytesIO(), format="PNG"))
+    return times
+
+
+def _distribution(samples):
+    # Milliseconds, the median and p90 show the typical cost, max the outliers of a busy machine
+    ms = np.asarray(samples) * 1000
+    return {
+        'count': int(ms.size),
+        'mean_ms': float(ms.mean()),
+        'median_ms': float(np.median(ms)),
+        'p90_ms': float(np.percentile(ms, 90)),
+        'min_ms': float(ms.min()),
+        'max_ms': float(ms.max()),
+        'total_ms': float(ms.sum())
+    }
+
+
+def measure_memory(path, size, palette_colors, background_color, quantize):
+    """
+    Memory of every stage of one run, separate from the timed runs as tracing slows them.
+    Pillow allocates pixel data outside the Python allocator, so tracemalloc only sees the Python side
+    (file buffers, arrays of the fixed quantizer), the pixel buffers are reported separately.
+    Returns ({stage: peak traced bytes}, {stage: pixel buffer bytes}).
+    """
+    peaks = {}
+    buffers = {}
+    current = [None]
+
+    def mark(stage):
+        if current[0] is not None:
+            peaks[current[0]] = tracemalloc.get_traced_memory()[1] - baseline[0]
+        tracemalloc.reset_peak()
+        baseline[0] = tracemalloc.get_traced_memory()[0]
+        current[0] = stage
+
+    baseline = [0]
+    tracemalloc.start()
+    try:
+        run_stages(path, size, palette_colors, background_color, quantize, mark=mark, buffers=buffers)
+        peaks[current[0]] = tracemalloc.get_traced_memory()[1] - baseline[0]
+    finally:
+        tracemalloc.stop()
+    return peaks, buffers
+
+
+def run_suite(paths, repeat=20, size=16, palette_colors=8, background_color=(0,0,0), quantize='adaptive'):
+    """Times every stage for every image, returns the report as a JSON serialisable dict"""
+    samples = {stage: [] for stage in STAGES}
+    images = []
+    skipped = []
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                width, height, mode = img.width, img.height, img.mode
+            # One untimed run so file caches and lazy imports don't land in the first sample
+            run_stages(path, size, palette_colors, background_color, quantize)
+        except Exception as e:
+            # Broken or unsupported files are left out instead of ending the whole run
+            print(f"Skipping {path}: {e}")
+            skipped.append(path)
+            continue
+        image_samples = {stage: [] for stage in STAGES}
+        totals = []
+        traced, buffers = measure_memory(path, size, palette_colors, background_color, quantize)
+        for _ in range(repeat):
+            times = run_stages(path, size, palette_colors, background_color, quantize)
+            for stage, seconds in times.items():
+                image_samples[stage].append(seconds)
+                samples[stage].append(seconds)
+            totals.append(sum(times.values()))
+        images.append({
+            'path': path,
+            'width': width,
+            'height': height,
+            'mode': mode,
+            'total': _distribution(totals),
+            'images_per_second': 1.0 / float(np.median(totals)),
+            'stages': {stage: _distribution(values) for stage, values in image_samples.items()},
+            'peak_traced_bytes': traced,
+            'buffer_bytes': buffers
+        })
+
+    stages = {stage: _distribution(values) for stage, values in samples.items() if values}
+    total_ms = sum(stage['total_ms'] for stage in stages.values())
+    for stage in stages.values():
+        stage['share'] = stage['total_ms'] / total_ms if total_ms else 0.0
+    runs = len(images) * repeat
+    peak_rss_kib = None
+    if resource:
+        peak_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in KiB on Linux but in bytes on macOS
+        if sys.platform == 'darwin':
+            peak_rss_kib //= 1024
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat,
+            'size': size,
+            'palette_colors': palette_colors,
+            'quantize': quantize
+        },
+        'images_per_second': runs / (total_ms / 1000) if total_ms else 0.0,
+        'stages': stages,
+        'images': images,
+        'skipped': skipped,
+        'peak_traced_bytes': max((max(image['peak_traced_bytes'].values()) for image in images), default=0),
+        'peak_buffer_bytes': max((max(image['buffer_bytes'].values()) for image in images), default=0),
+        'peak_rss_kib': peak_rss_kib
+    }
+
+
+def print_report(report, baseline=None):
+    print(f"{'stage':>11} {'median':>9} {'p90':>9} {'max':>9} {'share':>7}" + (f" {'vs base':>8}" if baseline else ""))
+    for stage, dist in report['stages'].items():
+        line = f"{stage:>11} {dist['median_ms']:8.3f}ms {dist['p90_ms']:8.3f}ms {dist['max_ms']:8.3f}ms {dist['share'] * 100:6.1f}%"
+        if baseline and stage in baseline['stages'] and baseline['stages'][stage]['median_ms']:
+            # Above 1.0 the stage got slower than in the baseline
+            line += f" {dist['median_ms'] / baseline['stages'][stage]['median_ms']:7.2f}x"
+        print(line)
+    print()
+    for image in report['images']:
+        slowest = max(image['stages'], key=lambda stage: image['stages'][stage]['median_ms'])
+        print(f"{image['path']} ({image['width']}x{image['height']} {image['mode']}): "
+              f"{image['images_per_second']:.1f} images/s, slowest stage {slowest}, "
+              f"largest buffer {max(image['buffer_bytes'].values()) / 1024:.1f} KiB, "
+              f"peak {max(image['peak_traced_bytes'].values()) / 1024:.1f} KiB traced")
+    print(f"\n{report['images_per_second']:.1f} images/s overall", end="")
+    if baseline:
+        print(f" (baseline {baseline['images_per_second']:.1f})", end="")
+    print(f", largest buffer {report['peak_buffer_bytes'] / 1024:.1f} KiB, peak {report['peak_traced_bytes'] / 1024:.1f} KiB traced"
+          + (f", {report['peak_rss_kib'] / 1024:.1f} MiB RSS" if report['peak_rss_kib'] else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times every stage of the Zhuanhuan pipeline per image")
+    parser.add_argument('dirs', nargs='*', default=['input', 'images'], help="directories with source images")
+    parser.add_argument('--repeat', type=int, default=20, help="timed runs per image")
+    parser.add_argument('--size', type=int, default=16)
+    parser.add_argument('--palette-colors', type=int, default=8)
+    parser.add_argument('--quantize', choices=['adaptive', 'fixed'], default='adaptive')
+    parser.add_argument('--json', default=DEFAULT_JSON, help="where the report is written")
+    parser.add_argument('--baseline', help="report of an earlier run to compare against")
+    args = parser.parse_args()
+
+    paths = collect_images(args.dirs)
+    if not paths:
+        print("No images found")
+        return
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    report = run_suite(paths, args.repeat, args.size, args.palette_colors, quantize=args.quantize)
+    if not report['images']:
+        print("None of the images could be processed, no report written")
+        return
+    print_report(report, baseline)
+    if report['skipped']:
+        print(f"Skipped {len(report['skipped'])} unreadable images")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+    with open(args.json, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print(f"Report written to {args.json}")
+
+if __name__ == '__main__':
+    main()